@@ -1,27 +1,60 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, send_file
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, send_file, abort, stream_with_context, g
+from werkzeug.http import is_resource_modified
 from markupsafe import Markup
 import json
 import os
 import datetime
+import calendar
 import hashlib
+import zlib
 import re
 import nltk
 from nltk.sentiment import SentimentIntensityAnalyzer
 import matplotlib
 matplotlib.use('Agg')  # Use non-interactive backend
 import matplotlib.pyplot as plt
-from io import BytesIO
-import base64
+from matplotlib.collections import LineCollection
+import numpy as np
+from io import BytesIO, StringIO
+import csv
 from reportlab.lib.pagesizes import letter
 from reportlab.lib import colors
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, Table, TableStyle
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
+import threading
+import atexit
+import time
+import click
+import logging
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+import glob
 import tempfile
+import secrets
+import sqlite3
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process locks apply
+    fcntl = None
+from collections import OrderedDict, Counter
+import heapq
+import bisect
+import enum
+from functools import lru_cache
+from itertools import islice
+import wave
+import subprocess
+try:
+    import vosk  # optional, for server-side speech recognition
+except ImportError:
+    vosk = None
 
 # Download NLTK data for sentiment analysis
 try:
-    nltk.data.find('vader_lexicon')
+    nltk.data.find('sentiment/vader_lexicon.zip')
 except LookupError:
     nltk.download('vader_lexicon')
 
@@ -34,7 +67,8 @@ def format_datetime(value, format='%Y-%m-%d'):
     """Format a date time to a specified format."""
     if value is None:
         return ""
-    return datetime.datetime.strptime(value, '%Y-%m-%d').strftime(format)
+    # date_ordinal caches the parsing, so long entry lists don't re-parse dates
+    return datetime.date.fromordinal(date_ordinal(value)).strftime(format)
 
 @app.template_filter('nl2br')
 def nl2br(value):
@@ -43,198 +77,2006 @@ def nl2br(value):
         return Markup(value.replace('\n', '<br>'))
     return value
 
+# Logging and metrics. Log lines are key=value pairs ("event=entries.save
+# user=bob count=3") on the "diary" logger; DIARY_LOG_LEVEL sets the level
+# (DEBUG, INFO, WARNING, ERROR) and OFF switches logging off. Timings are
+# kept as Prometheus histograms and served from /metrics: one for whole
+# requests (by route, method and status) and one for named spans around
+# the slow steps (loading and saving entries, sentiment scoring, charts and
+# PDF reports). Each process keeps its own metrics.
+LOG_LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL')
+LOG_LEVEL = (os.environ.get('DIARY_LOG_LEVEL') or 'INFO').strip().upper()
+logger = logging.getLogger('diary')
+logger.propagate = False
+if LOG_LEVEL == 'OFF':
+    logger.disabled = True
+else:
+    if not logger.handlers:
+        _log_handler = logging.StreamHandler()
+        _log_handler.setFormatter(logging.Formatter('time=%(asctime)s level=%(levelname)s %(message)s'))
+        logger.addHandler(_log_handler)
+    if LOG_LEVEL in LOG_LEVELS:
+        logger.setLevel(LOG_LEVEL)
+    else:
+        # A typo in the setting shouldn't stop the app from starting
+        logger.setLevel(logging.INFO)
+        logger.warning(f"event=config.invalid_log_level value={json.dumps(LOG_LEVEL)} "
+                       f"using=INFO expected={'|'.join(LOG_LEVELS + ('OFF',))}")
+        LOG_LEVEL = 'INFO'
+
+def _log_value(value):
+    """Quote a log field value if it contains spaces, quotes or newlines"""
+    value = str(value)
+    if not value or any(char in value for char in ' ="\n'):
+        return json.dumps(value)
+    return value
+
+def log_event(level, event, **fields):
+    """Log an event with key=value fields, e.g. log_event(logging.INFO, "entries.save", count=3)"""
+    if logger.isEnabledFor(level):
+        parts = [f"event={event}"] + [f"{key}={_log_value(value)}" for key, value in fields.items()]
+        logger.log(level, " ".join(parts))
+
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRIC_HELP = {
+    'diary_request_duration_seconds': 'Time spent handling HTTP requests',
+    'diary_span_duration_seconds': 'Time spent in named steps such as entry saves, scoring, charts and reports'
+}
+_histograms = {}  # metric name -> {sorted label items: {"buckets", "sum", "count"}}
+_metrics_lock = threading.Lock()
+
+def observe(name, seconds, **labels):
+    """Record a duration in a histogram"""
+    key = tuple(sorted(labels.items()))
+    index = bisect.bisect_left(METRIC_BUCKETS, seconds)  # the last slot is +Inf
+    
+    with _metrics_lock:
+        series = _histograms.setdefault(name, {})
+        data = series.get(key)
+        if data is None:
+            data = series[key] = {"buckets": [0] * (len(METRIC_BUCKETS) + 1), "sum": 0.0, "count": 0}
+        data['buckets'][index] += 1
+        data['sum'] += seconds
+        data['count'] += 1
+
+@contextmanager
+def span(name):
+    """Time a block, or a function when used as a decorator, as a named span"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe('diary_span_duration_seconds', elapsed, span=name)
+        log_event(logging.DEBUG, "span", name=name, seconds=f"{elapsed:.4f}")
+
+def _metric_labels(items):
+    """Format label pairs as name="value",... with Prometheus escaping"""
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ",".join(f'{key}="{escape(value)}"' for key, value in items)
+
+def render_metrics():
+    """Return all histograms in the Prometheus text exposition format"""
+    lines = []
+    with _metrics_lock:
+        for name, series in sorted(_histograms.items()):
+            lines.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, data in sorted(series.items()):
+                cumulative = 0
+                for bound, count in zip(METRIC_BUCKETS + ('+Inf',), data['buckets']):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{{{_metric_labels(key + (('le', bound),))}}} {cumulative}")
+                labels = f"{{{_metric_labels(key)}}}" if key else ""
+                lines.append(f"{name}_sum{labels} {data['sum']:.6f}")
+                lines.append(f"{name}_count{labels} {data['count']}")
+    return "\n".join(lines) + "\n"
+
 # Helper functions
-def get_user_entries(username):
-    """Load user entries from file"""
-    entries_file = f"entries_{username}.json"
+
+# Storage engine for entries (and users): "json" keeps the JSON snapshot and
+# journal files described below, "sqlite" keeps everything in SQLITE_DATABASE.
+# Run `flask import-sqlite` once before switching an existing install over.
+STORAGE_BACKEND = os.environ.get('DIARY_STORAGE_BACKEND', 'json')
+SQLITE_DATABASE = os.environ.get('DIARY_DATABASE', 'diary.db')
+
+# With the json engine, entries are stored as a snapshot
+# (entries_<username>.json, the same list of entries the app has always
+# written) plus an append-only journal (entries_<username>.log) with one JSON
+# operation per line:
+#
+#   {"op": "add", "entry": {...}}
+#   {"op": "edit", "entry": {...}}
+#   {"op": "delete", "id": 1747038302}
+#
+# Saving appends only the operations that changed, and the journal is folded
+# back into the snapshot once it grows past a fraction of the snapshot size.
+# Existing entries_*.json files are simply snapshots with an empty journal, so
+# they keep working without a migration step.
+JOURNAL_COMPACT_MIN_BYTES = 256 * 1024
+
+# Parsed entries are cached per user so that page views don't re-read and
+# re-parse the files. A cached copy is only used while the user's data version
+# (mtime and size of both files, or the version counter in SQLite) is
+# unchanged, and the least recently used users are evicted once the cache
+# grows past ENTRIES_CACHE_MAX_BYTES.
+ENTRIES_CACHE_MAX_BYTES = 64 * 1024 * 1024
+_entries_cache = OrderedDict()  # username -> (version, size, entries)
+_entries_cache_bytes = 0
+_entries_cache_lock = threading.Lock()
+
+# Writes to a user's entries are serialised by a per-user lock: a
+# threading.Lock for request threads in this process plus an flock on
+# entries_<username>.lock for other worker processes. The lock is held from
+# loading the current entries until the new ones are stored, so concurrent
+# saves can't overwrite each other's changes.
+_entry_write_locks = {}  # username -> threading.Lock
+_entry_write_locks_guard = threading.Lock()
+_entry_write_state = threading.local()
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive lock on path (created if missing) across processes"""
+    with open(path, "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+def atomic_write_json(path, data):
+    """Write data as JSON to a temporary file, then rename it over path"""
+    temp_file = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp_file, "w") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, path)
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+
+@contextmanager
+def user_entries_lock(username):
+    """Hold the write lock for a user's entries (re-entrant within a thread)"""
+    held = getattr(_entry_write_state, 'held', None)
+    if held is None:
+        held = _entry_write_state.held = set()
+    if username in held:
+        yield
+        return
+    
+    with _entry_write_locks_guard:
+        lock = _entry_write_locks.setdefault(username, threading.Lock())
+    
+    with lock, file_lock(f"entries_{username}.lock"):
+        held.add(username)
+        try:
+            yield
+        finally:
+            held.discard(username)
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    password TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    username TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    text TEXT NOT NULL,
+    word_count INTEGER NOT NULL,
+    mood TEXT NOT NULL,
+    extra TEXT,
+    PRIMARY KEY (username, id)
+);
+CREATE INDEX IF NOT EXISTS entries_user_date ON entries (username, date, id);
+CREATE INDEX IF NOT EXISTS entries_user_mood ON entries (username, mood, date);
+CREATE TABLE IF NOT EXISTS entry_versions (
+    username TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    updated_at REAL
+);
+CREATE TABLE IF NOT EXISTS entry_stats (
+    username TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entry_word_counts (
+    username TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+"""
+
+# Columns stored directly in the entries table; any other entry fields are
+# kept as JSON in the "extra" column
+ENTRY_COLUMNS = ('id', 'date', 'text', 'word_count', 'mood')
+
+@lru_cache(maxsize=65536)
+def date_ordinal(date):
+    """Convert a YYYY-MM-DD string to a proleptic Gregorian ordinal"""
+    return datetime.date.fromisoformat(date).toordinal()
+
+@lru_cache(maxsize=65536)
+def ordinal_date(ordinal):
+    """Convert an ordinal back to a YYYY-MM-DD string"""
+    return datetime.date.fromordinal(ordinal).isoformat()
+
+UNIX_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()  # day 0 of numpy's datetime64[D]
+
+class Mood(enum.IntEnum):
+    """Mood label of an entry, valued -1, 0 or 1"""
+    NEGATIVE = -1
+    NEUTRAL = 0
+    POSITIVE = 1
+    
+    @property
+    def label(self):
+        return self.name.capitalize()
+    
+    @classmethod
+    def from_label(cls, label):
+        return cls[label.upper()]
+
+class Entry:
+    """A diary entry as kept in memory
+    
+    Stored entries (JSON files, the journal, SQLite rows) and everything the
+    routes and templates see are plain dicts with an ISO date string and a
+    mood label. In memory the storage layer keeps this slotted form instead,
+    with the date as an ordinal and the mood as a Mood, so analytics and
+    reports compare integers rather than re-parsing date strings, and large
+    diaries take less memory. Fields other than the standard columns
+    (sentiment scores and so on) are kept as-is in extra.
+    """
+    __slots__ = ('id', 'ordinal', 'text', 'word_count', 'mood', 'extra')
+    
+    def __init__(self, id, ordinal, text, word_count, mood, extra=None):
+        self.id = id
+        self.ordinal = ordinal
+        self.text = text
+        self.word_count = word_count
+        self.mood = mood
+        self.extra = extra
+    
+    @classmethod
+    def from_dict(cls, data):
+        extra = {key: value for key, value in data.items() if key not in ENTRY_COLUMNS}
+        return cls(data['id'], date_ordinal(data['date']), data['text'], data['word_count'],
+                   Mood.from_label(data['mood']), extra or None)
+    
+    def to_dict(self):
+        data = {
+            "id": self.id,
+            "date": self.date,
+            "text": self.text,
+            "word_count": self.word_count,
+            "mood": self.mood.label
+        }
+        if self.extra:
+            data.update(self.extra)
+        return data
+    
+    @property
+    def date(self):
+        return ordinal_date(self.ordinal)
+    
+    @property
+    def day(self):
+        return datetime.date.fromordinal(self.ordinal)
+    
+    @property
+    def sentiment(self):
+        return self.extra.get('sentiment') if self.extra else None
+    
+    def __eq__(self, other):
+        if not isinstance(other, Entry):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+    
+    def __repr__(self):
+        return f"Entry(id={self.id!r}, date={self.date!r}, mood={self.mood.label!r})"
+
+def entry_order(entry):
+    """Sort key that keeps Entry lists in (date, id) order"""
+    return (entry.ordinal, entry.id)
+
+def entry_day(entry):
+    """Bisection key for finding dates in an ordered Entry list"""
+    return entry.ordinal
+
+# Page sizes for the entries listing
+ENTRIES_PER_PAGE = 20
+MAX_ENTRIES_PER_PAGE = 100
+
+_sqlite_local = threading.local()
+
+def get_db(path=None):
+    """Return this thread's SQLite connection, creating the schema on first use"""
+    path = path or SQLITE_DATABASE
+    connections = getattr(_sqlite_local, 'connections', None)
+    if connections is None:
+        connections = _sqlite_local.connections = {}
+    
+    db = connections.get(path)
+    if db is None:
+        db = sqlite3.connect(path, timeout=30)
+        db.row_factory = sqlite3.Row
+        # WAL lets readers keep going while another connection writes
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.executescript(SQLITE_SCHEMA)
+        
+        # Databases created before entry_versions.updated_at existed
+        columns = {row['name'] for row in db.execute("PRAGMA table_info(entry_versions)")}
+        if 'updated_at' not in columns:
+            db.execute("ALTER TABLE entry_versions ADD COLUMN updated_at REAL")
+        connections[path] = db
+    
+    return db
+
+def _entry_to_row(username, entry):
+    """Convert an entry dict to an entries table row"""
+    extra = {key: value for key, value in entry.items() if key not in ENTRY_COLUMNS}
+    return (username, entry['id'], entry['date'], entry['text'], entry['word_count'],
+            entry['mood'], json.dumps(extra) if extra else None)
+
+def _row_to_entry(row):
+    """Convert an entries table row to an Entry"""
+    return Entry(row['id'], date_ordinal(row['date']), row['text'], row['word_count'],
+                 Mood.from_label(row['mood']), json.loads(row['extra']) if row['extra'] else None)
+
+def _sqlite_write_ops(db, username, ops, replace=False):
+    """Apply journal-style operations to the entries table and bump the version"""
+    upserts = [_entry_to_row(username, op['entry']) for op in ops if op['op'] != 'delete']
+    deletes = [(username, op['id']) for op in ops if op['op'] == 'delete']
+    
+    with db:
+        if replace:
+            db.execute("DELETE FROM entries WHERE username = ?", (username,))
+        db.executemany(
+            "INSERT INTO entries (username, id, date, text, word_count, mood, extra) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (username, id) DO UPDATE SET date = excluded.date, text = excluded.text, "
+            "word_count = excluded.word_count, mood = excluded.mood, extra = excluded.extra",
+            upserts)
+        db.executemany("DELETE FROM entries WHERE username = ? AND id = ?", deletes)
+        db.execute(
+            "INSERT INTO entry_versions (username, version, updated_at) VALUES (?, 1, ?) "
+            "ON CONFLICT (username) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at",
+            (username, time.time()))
+
+def _sqlite_replace_entries(db, username, entries):
+    """Replace all of a user's entries in one transaction"""
+    _sqlite_write_ops(db, username, [{"op": "add", "entry": entry.to_dict()} for entry in entries], replace=True)
+
+def _entries_files(username):
+    """Return the snapshot and journal file names for a user"""
+    return f"entries_{username}.json", f"entries_{username}.log"
+
+def _entries_version(username):
+    """Return a tuple that changes whenever the user's stored entries change"""
+    if STORAGE_BACKEND == 'sqlite':
+        row = get_db().execute(
+            "SELECT version FROM entry_versions WHERE username = ?", (username,)).fetchone()
+        return (row['version'] if row else 0, 0, 0, 0)
+    
+    version = []
+    for path in _entries_files(username):
+        try:
+            stat = os.stat(path)
+            version += [stat.st_mtime_ns, stat.st_size]
+        except FileNotFoundError:
+            version += [0, 0]
+    return tuple(version)
+
+def get_entries_data_version(username):
+    """Return (version string, last modified datetime or None) for a user's entries"""
+    if STORAGE_BACKEND == 'sqlite':
+        row = get_db().execute(
+            "SELECT version, updated_at FROM entry_versions WHERE username = ?", (username,)).fetchone()
+        if not row:
+            return "0", None
+        updated_at = row['updated_at']
+        last_modified = (datetime.datetime.fromtimestamp(updated_at, datetime.timezone.utc)
+                         if updated_at else None)
+        return str(row['version']), last_modified
+    
+    version = _entries_version(username)
+    mtime_ns = max(version[0], version[2])
+    last_modified = (datetime.datetime.fromtimestamp(mtime_ns / 1e9, datetime.timezone.utc)
+                     if mtime_ns else None)
+    return "-".join(str(part) for part in version), last_modified
+
+def _entries_size(version, entries):
+    """Rough memory cost of a cached entry list"""
+    if STORAGE_BACKEND == 'sqlite':
+        return sum(len(entry.text) + 100 for entry in entries)
+    return version[1] + version[3]
+
+def _copy_entries(entries):
+    """Convert entries to dicts that callers can modify without touching the cache"""
+    return [entry.to_dict() for entry in entries]
+
+def _cache_user_entries(username, version, entries):
+    """Store parsed entries for a user and evict old users over the memory cap"""
+    global _entries_cache_bytes
+    
+    size = _entries_size(version, entries)
+    
+    with _entries_cache_lock:
+        previous = _entries_cache.pop(username, None)
+        if previous:
+            _entries_cache_bytes -= previous[1]
+        
+        # Don't let a single huge diary flush everyone else out
+        if size > ENTRIES_CACHE_MAX_BYTES:
+            return
+        
+        _entries_cache[username] = (version, size, entries)
+        _entries_cache_bytes += size
+        
+        while _entries_cache_bytes > ENTRIES_CACHE_MAX_BYTES:
+            _, (_, old_size, _) = _entries_cache.popitem(last=False)
+            _entries_cache_bytes -= old_size
+
+def _get_cached_entries(username, version):
+    """Return cached entries if they still match the stored version"""
+    with _entries_cache_lock:
+        cached = _entries_cache.get(username)
+        if cached is None or cached[0] != version:
+            return None
+        
+        _entries_cache.move_to_end(username)
+        return cached[2]
+
+def invalidate_user_entries(username):
+    """Drop a user's cached entries"""
+    global _entries_cache_bytes
+    
+    with _entries_cache_lock:
+        previous = _entries_cache.pop(username, None)
+        if previous:
+            _entries_cache_bytes -= previous[1]
+
+def _apply_entry_ops(entries, ops):
+    """Return a new Entry list with journal operations applied"""
+    # Applying is idempotent (adds and edits upsert, deletes ignore missing
+    # ids), so replaying a journal over a snapshot that already contains some
+    # of its operations is harmless.
+    #
+    # The list stays in (date, id) order: entries are found and inserted by
+    # bisection, and an edit that changes the date moves the entry.
+    entries = list(entries)
+    by_id = {entry.id: entry for entry in entries}
+    
+    for op in ops:
+        if op['op'] == 'delete':
+            old_entry = by_id.pop(op['id'], None)
+        else:
+            entry = Entry.from_dict(op['entry'])
+            old_entry = by_id.get(entry.id)
+            by_id[entry.id] = entry
+        
+        if old_entry is not None:
+            del entries[bisect.bisect_left(entries, entry_order(old_entry), key=entry_order)]
+        if op['op'] != 'delete':
+            bisect.insort(entries, entry, key=entry_order)
+    
+    return entries
+
+def _read_journal(username):
+    """Read a user's snapshot and replay the journal on top of it"""
+    snapshot_file, journal_file = _entries_files(username)
+    
+    entries = []
+    if os.path.exists(snapshot_file):
+        with open(snapshot_file, "r") as f:
+            entries = [Entry.from_dict(entry) for entry in json.load(f)]
+        # Snapshots are written in order; older files may not be
+        entries.sort(key=entry_order)
+    
+    if not os.path.exists(journal_file):
+        return entries
+    
+    ops = []
+    with open(journal_file, "r") as f:
+        for line in f:
+            try:
+                ops.append(json.loads(line))
+            except ValueError:
+                # Torn write from a crash; it was never acknowledged
+                continue
+    
+    return _apply_entry_ops(entries, ops)
+
+@span('entries.load')
+def _read_entries(username):
+    """Read a user's entries from the storage engine"""
+    if STORAGE_BACKEND == 'sqlite':
+        rows = get_db().execute(
+            "SELECT * FROM entries WHERE username = ? ORDER BY date, id", (username,))
+        return [_row_to_entry(row) for row in rows]
+    return _read_journal(username)
+
+def _load_user_entries(username):
+    """Return the current entries for a user, in (date, id) order, and their version (shared, don't modify)"""
+    version = _entries_version(username)
+    if version == (0, 0, 0, 0):
+        invalidate_user_entries(username)
+        return [], version
+    
+    entries = _get_cached_entries(username, version)
+    if entries is None:
+        entries = _read_entries(username)
+        _cache_user_entries(username, version, entries)
+    
+    return entries, version
+
+def _diff_entries(old_entries, new_entries):
+    """Return journal operations turning old_entries into new_entries (both Entry lists), or None"""
+    old_by_id = {entry.id: entry for entry in old_entries}
+    new_by_id = {entry.id: entry for entry in new_entries}
+    
+    # Duplicate ids can't be expressed as journal operations
+    if len(old_by_id) != len(old_entries) or len(new_by_id) != len(new_entries):
+        return None
     
-    if os.path.exists(entries_file):
-        with open(entries_file, "r") as f:
-            return json.load(f)
-    else:
-        return []
+    ops = []
+    for entry in new_entries:
+        old_entry = old_by_id.get(entry.id)
+        if old_entry is None:
+            ops.append({"op": "add", "entry": entry.to_dict()})
+        elif old_entry != entry:
+            ops.append({"op": "edit", "entry": entry.to_dict()})
+    
+    for entry_id in old_by_id:
+        if entry_id not in new_by_id:
+            ops.append({"op": "delete", "id": entry_id})
+    
+    return ops
+
+def _append_journal(username, ops):
+    """Append operations to a user's journal and flush them to disk"""
+    _, journal_file = _entries_files(username)
+    
+    with open(journal_file, "a+b") as f:
+        # Make sure a torn line from an earlier crash stays on its own line
+        if f.tell() > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+        
+        f.write("".join(json.dumps(op) + "\n" for op in ops).encode("utf-8"))
+        f.flush()
+        os.fsync(f.fileno())
+
+def compact_user_entries(username, entries):
+    """Write entries as a new snapshot and clear the journal"""
+    snapshot_file, journal_file = _entries_files(username)
+    
+    # Write to a temporary file and rename so a crash never leaves a
+    # half-written snapshot behind
+    atomic_write_json(snapshot_file, [entry.to_dict() for entry in entries])
+    
+    if os.path.exists(journal_file):
+        os.remove(journal_file)
+
+def _entry_changes(old_entries, ops):
+    """Pair each operation with the Entry it replaces, as (old, new) tuples"""
+    touched = {op['id'] if op['op'] == 'delete' else op['entry']['id'] for op in ops}
+    current = {entry.id: entry for entry in old_entries if entry.id in touched}
+    
+    changes = []
+    for op in ops:
+        if op['op'] == 'delete':
+            entry_id, new_entry = op['id'], None
+        else:
+            entry_id, new_entry = op['entry']['id'], Entry.from_dict(op['entry'])
+        changes.append((current.get(entry_id), new_entry))
+        current[entry_id] = new_entry
+    
+    return changes
+
+# Functions called as handler(username, changes, entries, old_version,
+# new_version) after every write, to keep derived data (aggregates, indexes)
+# up to date. changes is a list of (old Entry or None, new Entry or None), or
+# None when the whole list was replaced and derived data must be rebuilt.
+ENTRY_CHANGE_HANDLERS = []
+
+@span('entries.save')
+def _write_entry_ops(username, ops, entries, version, old_entries):
+    """Persist operations that turn the stored entries (old_entries) into entries"""
+    if STORAGE_BACKEND == 'sqlite':
+        if ops is None:
+            _sqlite_replace_entries(get_db(), username, entries)
+        elif ops:
+            _sqlite_write_ops(get_db(), username, ops)
+    elif ops is None:
+        compact_user_entries(username, entries)
+    elif ops:
+        _append_journal(username, ops)
+        
+        # Fold the journal into the snapshot once it gets large
+        _, journal_file = _entries_files(username)
+        if os.path.getsize(journal_file) > max(JOURNAL_COMPACT_MIN_BYTES, version[1] // 2):
+            compact_user_entries(username, entries)
+    
+    # Keep the cache warm with what we just wrote
+    new_version = _entries_version(username)
+    _cache_user_entries(username, new_version, entries)
+    
+    if ops is None or ops:
+        changes = _entry_changes(old_entries, ops) if ops is not None else None
+        for handler in ENTRY_CHANGE_HANDLERS:
+            handler(username, changes, entries, version, new_version)
+
+def get_user_entries(username):
+    """Load user entries, oldest first, from file (or the in-memory cache)"""
+    entries, _ = _load_user_entries(username)
+    return _copy_entries(entries)
+
+def get_user_entry(username, entry_id):
+    """Load a single entry by id, or None if it doesn't exist"""
+    if STORAGE_BACKEND == 'sqlite':
+        row = get_db().execute(
+            "SELECT * FROM entries WHERE username = ? AND id = ?", (username, entry_id)).fetchone()
+        return _row_to_entry(row).to_dict() if row else None
+    
+    entries, _ = _load_user_entries(username)
+    entry = next((e for e in entries if e.id == entry_id), None)
+    return entry.to_dict() if entry else None
+
+def get_user_entries_by_id(username, entry_ids):
+    """Load several entries at once, as a dict of id -> entry (missing ids are left out)"""
+    entry_ids = set(entry_ids)
+    if not entry_ids:
+        return {}
+    
+    if STORAGE_BACKEND == 'sqlite':
+        placeholders = ", ".join("?" * len(entry_ids))
+        rows = get_db().execute(
+            f"SELECT * FROM entries WHERE username = ? AND id IN ({placeholders})",
+            [username, *entry_ids])
+        return {row['id']: _row_to_entry(row).to_dict() for row in rows}
+    
+    # One pass over the entries instead of a lookup per id
+    entries, _ = _load_user_entries(username)
+    return {entry.id: entry.to_dict() for entry in entries if entry.id in entry_ids}
+
+def _entry_filter_sql(username, date_from, date_to, mood):
+    """Build the WHERE clause and parameters for an entry query"""
+    sql = "WHERE username = ?"
+    params = [username]
+    if date_from:
+        sql += " AND date >= ?"
+        params.append(date_from)
+    if date_to:
+        sql += " AND date <= ?"
+        params.append(date_to)
+    if mood:
+        sql += " AND mood = ?"
+        params.append(mood)
+    return sql, params
+
+def _entry_range(entries, date_from, date_to):
+    """Return (start, end) bounds of a date range (inclusive) in an ordered Entry list"""
+    start = bisect.bisect_left(entries, date_ordinal(date_from), key=entry_day) if date_from else 0
+    end = bisect.bisect_right(entries, date_ordinal(date_to), key=entry_day) if date_to else len(entries)
+    return start, max(start, end)
+
+def _matching_entries(entries, date_from, date_to, mood, newest_first=False, after=None):
+    """Iterate an ordered Entry list over a date range, optionally filtered by mood
+    
+    Only the entries in range are visited, and newest_first walks the list
+    backwards, so taking the first k costs O(k) after two bisections.
+    """
+    start, end = _entry_range(entries, date_from, date_to)
+    if after:
+        after = (date_ordinal(after[0]), after[1])
+        if newest_first:
+            end = min(end, bisect.bisect_left(entries, after, key=entry_order))
+        else:
+            start = max(start, bisect.bisect_right(entries, after, key=entry_order))
+    
+    indexes = range(end - 1, start - 1, -1) if newest_first else range(start, end)
+    matches = (entries[i] for i in indexes)
+    if mood:
+        mood = Mood.from_label(mood)
+        matches = (entry for entry in matches if entry.mood == mood)
+    return matches
+
+def query_user_entries(username, date_from=None, date_to=None, mood=None, newest_first=True,
+                       limit=None, offset=0, after=None):
+    """Load entries in a date range (inclusive), optionally filtered by mood, in date order
+    
+    after is a (date, id) cursor: only entries that come after it in the
+    requested order are returned.
+    """
+    if STORAGE_BACKEND == 'sqlite':
+        where, params = _entry_filter_sql(username, date_from, date_to, mood)
+        if after:
+            where += " AND (date, id) < (?, ?)" if newest_first else " AND (date, id) > (?, ?)"
+            params += list(after)
+        sql = f"SELECT * FROM entries {where}"
+        sql += " ORDER BY date DESC, id DESC" if newest_first else " ORDER BY date, id"
+        if limit is not None or offset:
+            sql += " LIMIT ? OFFSET ?"
+            params += [-1 if limit is None else limit, offset]
+        return [_row_to_entry(row).to_dict() for row in get_db().execute(sql, params)]
+    
+    entries, _ = _load_user_entries(username)
+    matches = _matching_entries(entries, date_from, date_to, mood, newest_first, after)
+    end = None if limit is None else offset + limit
+    return _copy_entries(islice(matches, offset, end))
+
+def iter_user_entries(username, date_from=None, date_to=None):
+    """Yield entry dicts in a date range (inclusive), oldest first, one at a time"""
+    if STORAGE_BACKEND == 'sqlite':
+        where, params = _entry_filter_sql(username, date_from, date_to, None)
+        # Iterating the cursor fetches rows as they are needed, not all at once
+        for row in get_db().execute(f"SELECT * FROM entries {where} ORDER BY date, id", params):
+            yield _row_to_entry(row).to_dict()
+        return
+    
+    entries, _ = _load_user_entries(username)
+    for entry in _matching_entries(entries, date_from, date_to, None):
+        yield entry.to_dict()
+
+def count_user_entries(username, date_from=None, date_to=None, mood=None):
+    """Count entries in a date range (inclusive), optionally filtered by mood"""
+    if STORAGE_BACKEND == 'sqlite':
+        where, params = _entry_filter_sql(username, date_from, date_to, mood)
+        return get_db().execute(f"SELECT COUNT(*) FROM entries {where}", params).fetchone()[0]
+    
+    entries, _ = _load_user_entries(username)
+    if not mood:
+        start, end = _entry_range(entries, date_from, date_to)
+        return end - start
+    return sum(1 for _ in _matching_entries(entries, date_from, date_to, mood))
+
+def get_entry_dates(username, date_from=None, date_to=None):
+    """Return the sorted list of distinct dates that have entries, optionally within a date range (inclusive)"""
+    if STORAGE_BACKEND == 'sqlite':
+        sql = "SELECT DISTINCT date FROM entries WHERE username = ?"
+        params = [username]
+        if date_from:
+            sql += " AND date >= ?"
+            params.append(date_from)
+        if date_to:
+            sql += " AND date <= ?"
+            params.append(date_to)
+        rows = get_db().execute(sql + " ORDER BY date", params)
+        return [row['date'] for row in rows]
+    
+    entries, _ = _load_user_entries(username)
+    start, end = _entry_range(entries, date_from, date_to)
+    return [ordinal_date(ordinal) for ordinal in dict.fromkeys(entry.ordinal for entry in entries[start:end])]
 
 def save_user_entries(username, entries):
     """Save user entries to file"""
-    entries_file = f"entries_{username}.json"
-    
-    # Debug information
-    print(f"Saving entries to {entries_file}")
-    print(f"Number of entries: {len(entries)}")
-    print(f"First entry date: {entries[0]['date'] if entries else 'No entries'}")
-    
-    with open(entries_file, "w") as f:
-        json.dump(entries, f)
+    entries_file, _ = _entries_files(username)
+    log_event(logging.DEBUG, "entries.save", user=username, count=len(entries),
+              storage=entries_file if STORAGE_BACKEND == 'json' else SQLITE_DATABASE)
+    
+    with user_entries_lock(username):
+        old_entries, version = _load_user_entries(username)
+        new_entries = sorted((Entry.from_dict(entry) for entry in entries), key=entry_order)
+        ops = _diff_entries(old_entries, new_entries)
+        _write_entry_ops(username, ops, new_entries, version, old_entries)
+
+def update_user_entries(username, upserts=(), deletes=()):
+    """Add or replace entries and delete entries by id without resaving the rest"""
+    with user_entries_lock(username):
+        old_entries, version = _load_user_entries(username)
+        
+        existing_ids = {entry.id for entry in old_entries}
+        ops = [
+            {"op": "edit" if entry['id'] in existing_ids else "add", "entry": dict(entry)}
+            for entry in upserts
+        ]
+        ops += [
+            {"op": "delete", "id": entry_id}
+            for entry_id in dict.fromkeys(deletes) if entry_id in existing_ids
+        ]
+        
+        if ops:
+            _write_entry_ops(username, ops, _apply_entry_ops(old_entries, ops), version, old_entries)
+    
+    return len(ops)
+
+# Per-user aggregates (entry count, total words, mood counts, per-day entry
+# count and compound sum) are updated from each write's changes instead of
+# being recomputed from every entry on each page view. They are small, so
+# they are persisted on every write in stats_<username>.json (or the
+# entry_stats table) together with the entry data version they describe,
+# and rebuilt from the entries if that version doesn't match, e.g. after a
+# crash. Other processes therefore see up to date stats without a rebuild.
+#
+# The word counts for the word frequency chart are much larger than a single
+# entry, so they are kept separately in words_<username>.json (or the
+# entry_word_counts table) and not rewritten on every save: updates stay in
+# memory and are flushed after STATS_FLUSH_WRITES writes, once the oldest
+# unflushed write is STATS_FLUSH_SECONDS old, and at exit. Word counts that
+# weren't flushed (or weren't in memory during a write) just no longer match
+# and get rebuilt, but only when the word chart is drawn.
+STATS_FORMAT = 4  # bump when the stats layout changes to force a rebuild
+STATS_CACHE_MAX_USERS = 1000
+STATS_FLUSH_WRITES = 50
+STATS_FLUSH_SECONDS = 60
+_stats_cache = OrderedDict()  # username -> stats
+_word_counts_cache = OrderedDict()  # username -> {"version": ..., "words": {word: occurrences}}
+_word_counts_unflushed = {}  # username -> (writes not yet persisted, when the first of them happened)
+_stats_cache_lock = threading.Lock()
+
+def entry_compound(entry):
+    """Return an Entry's stored compound score (-1 to 1)
+    
+    Entries that haven't been scored yet (see backfill_user_sentiment) fall
+    back to -1, 0 or 1 from their mood.
+    """
+    sentiment = entry.sentiment
+    if sentiment:
+        return sentiment['compound']
+    return int(entry.mood)
+
+def _empty_stats():
+    """Return aggregates for a user without entries"""
+    return {
+        "count": 0,
+        "total_words": 0,
+        "moods": {"Positive": 0, "Neutral": 0, "Negative": 0},
+        "days": {}  # date -> [entry count, sum of compound scores]
+    }
 
-def analyze_mood(text):
-    """Analyze the mood of the text using NLTK's sentiment analyzer"""
-    sia = SentimentIntensityAnalyzer()
-    sentiment = sia.polarity_scores(text)
+def _add_to_stats(stats, entry, sign):
+    """Add (sign=1) or remove (sign=-1) an entry's contribution to the aggregates"""
+    stats['count'] += sign
+    stats['total_words'] += sign * entry.word_count
+    label = entry.mood.label
+    stats['moods'][label] = stats['moods'].get(label, 0) + sign
+    
+    date = entry.date
+    count, compound_sum = stats['days'].get(date, (0, 0))
+    count += sign
+    compound_sum = round(compound_sum + sign * entry_compound(entry), 4)
+    if count:
+        stats['days'][date] = [count, compound_sum]
+    else:
+        stats['days'].pop(date, None)
+
+def _add_to_word_counts(words, entry, sign):
+    """Add (sign=1) or remove (sign=-1) an entry's words from the word counts"""
+    for word, occurrences in count_words(entry.text).items():
+        occurrences = words.get(word, 0) + sign * occurrences
+        if occurrences:
+            words[word] = occurrences
+        else:
+            del words[word]
+
+# Words left out of the word frequency chart
+COMMON_WORDS = frozenset({'the', 'and', 'to', 'a', 'of', 'in', 'i', 'is', 'that', 'it', 'for', 'on', 'with', 'as', 'was', 'be', 'this', 'have', 'are', 'not', 'but', 'at', 'from', 'or', 'an', 'my', 'by', 'they', 'you', 'we', 'their', 'his', 'her', 'she', 'he', 'had', 'has', 'been', 'were', 'would', 'could', 'should', 'will', 'can', 'do', 'does', 'did', 'just', 'me', 'them', 'so', 'what', 'who', 'when', 'where', 'why', 'how', 'which', 'there', 'here', 'am', 'if', 'then', 'than', 'your', 'our', 'us', 'very', 'much', 'more', 'most', 'some', 'any', 'all', 'no', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten'})
+WORD_PATTERN = re.compile(r'\b[a-zA-Z]{3,}\b')
+
+def count_words(text):
+    """Count the words of 3+ letters in text, skipping common words"""
+    return Counter(word for word in WORD_PATTERN.findall(text.lower()) if word not in COMMON_WORDS)
+
+def top_words(word_counts, k=10):
+    """Return the k most frequent (word, count) pairs, ties in alphabetical order"""
+    # Selecting with a bounded heap is O(vocabulary * log k) instead of a full sort
+    return heapq.nsmallest(k, word_counts.items(), key=lambda item: (-item[1], item[0]))
+
+def build_user_stats(entries):
+    """Compute aggregates from scratch"""
+    stats = _empty_stats()
+    for entry in entries:
+        _add_to_stats(stats, entry, 1)
+    return stats
+
+def build_word_counts(entries):
+    """Count the words of all entries from scratch"""
+    words = {}
+    for entry in entries:
+        _add_to_word_counts(words, entry, 1)
+    return words
+
+def _stats_file(username):
+    return f"stats_{username}.json"
+
+def _word_counts_file(username):
+    return f"words_{username}.json"
+
+def _read_record(table, filename, username):
+    """Load a persisted per-user JSON record, or None"""
+    if STORAGE_BACKEND == 'sqlite':
+        row = get_db().execute(f"SELECT data FROM {table} WHERE username = ?", (username,)).fetchone()
+        return json.loads(row['data']) if row else None
     
-    # Determine mood based on compound score
-    if sentiment['compound'] >= 0.05:
+    try:
+        with open(filename, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def _write_record(table, filename, username, data):
+    """Persist a per-user JSON record"""
+    if STORAGE_BACKEND == 'sqlite':
+        db = get_db()
+        with db:
+            db.execute(
+                f"INSERT INTO {table} (username, data) VALUES (?, ?) "
+                "ON CONFLICT (username) DO UPDATE SET data = excluded.data",
+                (username, json.dumps(data)))
+        return
+    
+    atomic_write_json(filename, data)
+
+def _read_stats(username):
+    """Load persisted aggregates, or None"""
+    return _read_record('entry_stats', _stats_file(username), username)
+
+def _write_stats(username, stats):
+    """Persist aggregates"""
+    _write_record('entry_stats', _stats_file(username), username, stats)
+
+def _read_word_counts(username):
+    """Load persisted word counts, or None"""
+    return _read_record('entry_word_counts', _word_counts_file(username), username)
+
+def _write_word_counts(username, record):
+    """Persist word counts"""
+    _write_record('entry_word_counts', _word_counts_file(username), username, record)
+
+def _remember(cache, username, value):
+    with _stats_cache_lock:
+        cache[username] = value
+        cache.move_to_end(username)
+        while len(cache) > STATS_CACHE_MAX_USERS:
+            evicted, _ = cache.popitem(last=False)
+            if cache is _word_counts_cache:
+                _word_counts_unflushed.pop(evicted, None)  # rebuilt from the entries if needed
+
+def _for_version(cache, read, username, version):
+    """Return a cached or persisted record if it matches version, else None"""
+    with _stats_cache_lock:
+        record = cache.get(username)
+    if record is not None and record['version'] == list(version):
+        return record
+    
+    record = read(username)
+    if record is not None and record.get('version') == list(version) and record.get('format') == STATS_FORMAT:
+        _remember(cache, username, record)
+        return record
+    return None
+
+def _stats_for_version(username, version):
+    """Return cached or persisted aggregates if they match version, else None"""
+    return _for_version(_stats_cache, _read_stats, username, version)
+
+def get_user_stats(username):
+    """Return a user's aggregates (shared, don't modify)"""
+    version = _entries_version(username)
+    stats = _stats_for_version(username, version)
+    if stats is None:
+        entries, version = _load_user_entries(username)
+        stats = build_user_stats(entries)
+        stats['version'] = list(version)
+        stats['format'] = STATS_FORMAT
+        _write_stats(username, stats)
+        _remember(_stats_cache, username, stats)
+    return stats
+
+def get_user_word_counts(username):
+    """Return a user's word -> occurrences counts (shared, don't modify)"""
+    version = _entries_version(username)
+    record = _for_version(_word_counts_cache, _read_word_counts, username, version)
+    if record is None:
+        entries, version = _load_user_entries(username)
+        record = {"version": list(version), "format": STATS_FORMAT, "words": build_word_counts(entries)}
+        _flush_word_counts(username, record)
+        _remember(_word_counts_cache, username, record)
+    return record['words']
+
+def _update_user_stats(username, changes, entries, old_version, new_version):
+    """Apply a write's changes to the user's aggregates"""
+    stats = _stats_for_version(username, old_version) if changes is not None else None
+    
+    if stats is None:
+        stats = build_user_stats(entries)
+    else:
+        # Work on a copy so readers never see a half-applied update
+        stats = {
+            "count": stats['count'],
+            "total_words": stats['total_words'],
+            "moods": dict(stats['moods']),
+            "days": dict(stats['days'])
+        }
+        for old_entry, new_entry in changes:
+            if old_entry is not None:
+                _add_to_stats(stats, old_entry, -1)
+            if new_entry is not None:
+                _add_to_stats(stats, new_entry, 1)
+    
+    stats['version'] = list(new_version)
+    stats['format'] = STATS_FORMAT
+    _write_stats(username, stats)
+    _remember(_stats_cache, username, stats)
+
+ENTRY_CHANGE_HANDLERS.append(_update_user_stats)
+
+def _update_user_word_counts(username, changes, entries, old_version, new_version):
+    """Apply a write's changes to the user's word counts, if they are in memory"""
+    with _stats_cache_lock:
+        record = _word_counts_cache.get(username)
+    
+    if changes is None or record is None or record['version'] != list(old_version):
+        # Nobody has asked for them lately (or everything changed), so don't
+        # count words here; get_user_word_counts rebuilds them when the chart
+        # is drawn
+        with _stats_cache_lock:
+            _word_counts_cache.pop(username, None)
+            _word_counts_unflushed.pop(username, None)
+        return
+    
+    # Work on a copy so readers never see a half-applied update
+    words = dict(record['words'])
+    for old_entry, new_entry in changes:
+        if old_entry is not None:
+            _add_to_word_counts(words, old_entry, -1)
+        if new_entry is not None:
+            _add_to_word_counts(words, new_entry, 1)
+    record = {"version": list(new_version), "format": STATS_FORMAT, "words": words}
+    _remember(_word_counts_cache, username, record)
+    
+    with _stats_cache_lock:
+        writes, since = _word_counts_unflushed.get(username, (0, time.monotonic()))
+        writes += 1
+        _word_counts_unflushed[username] = (writes, since)
+    if writes >= STATS_FLUSH_WRITES or time.monotonic() - since >= STATS_FLUSH_SECONDS:
+        _flush_word_counts(username, record)
+
+ENTRY_CHANGE_HANDLERS.append(_update_user_word_counts)
+
+def _flush_word_counts(username, record):
+    """Persist a user's in-memory word counts"""
+    with _stats_cache_lock:
+        _word_counts_unflushed.pop(username, None)
+    _write_word_counts(username, record)
+
+def flush_all_word_counts():
+    """Persist every user's word counts that have unflushed updates"""
+    with _stats_cache_lock:
+        pending = [(username, _word_counts_cache.get(username)) for username in _word_counts_unflushed]
+    for username, record in pending:
+        if record is not None:
+            _flush_word_counts(username, record)
+
+atexit.register(flush_all_word_counts)
+
+# Full-text search uses a per-user inverted index kept in memory: for each
+# term, the ids of the entries containing it and the token positions where it
+# occurs (positions make phrase queries possible). Like the entries cache it
+# is tied to the entry data version; writes update it from their changes, and
+# an index for an older version (another process wrote, or the app restarted)
+# is rebuilt from the entries on the next search.
+SEARCH_INDEX_MAX_USERS = 100
+SEARCH_PREFIX_MAX_TERMS = 50  # terms a prefix query like "walk*" expands to
+SEARCH_SNIPPET_TOKENS = 30
+TOKEN_PATTERN = re.compile(r"\w+")
+_search_indexes = OrderedDict()  # username -> index
+_search_lock = threading.Lock()
+
+def tokenize(text):
+    """Split text into lowercase search terms"""
+    return [match.group().lower() for match in TOKEN_PATTERN.finditer(text)]
+
+def _index_entry(index, entry, sign, keep_sorted=True):
+    """Add (sign=1) or remove (sign=-1) an entry's postings"""
+    entry_id = entry.id
+    terms = tokenize(entry.text)
+    
+    if sign > 0:
+        for position, term in enumerate(terms):
+            postings = index['postings'].get(term)
+            if postings is None:
+                postings = index['postings'][term] = {}
+                if keep_sorted:
+                    bisect.insort(index['terms'], term)
+            postings.setdefault(entry_id, []).append(position)
+        index['docs'][entry_id] = (len(terms), entry.ordinal)
+        index['total_length'] += len(terms)
+    else:
+        for term in set(terms):
+            postings = index['postings'].get(term)
+            if postings is None:
+                continue
+            postings.pop(entry_id, None)
+            if not postings:
+                del index['postings'][term]
+                del index['terms'][bisect.bisect_left(index['terms'], term)]
+        length, _ = index['docs'].pop(entry_id, (0, None))
+        index['total_length'] -= length
+
+def build_search_index(entries, version):
+    """Build the search index for a list of entries"""
+    index = {
+        "version": version,
+        "postings": {},  # term -> {entry id: [positions]}
+        "terms": [],  # sorted vocabulary, for prefix queries
+        "docs": {},  # entry id -> (number of tokens, date ordinal)
+        "total_length": 0
+    }
+    for entry in entries:
+        _index_entry(index, entry, 1, keep_sorted=False)
+    index['terms'] = sorted(index['postings'])
+    return index
+
+def _update_search_index(username, changes, entries, old_version, new_version):
+    """Apply a write's changes to the user's search index, if one is loaded"""
+    with _search_lock:
+        index = _search_indexes.get(username)
+        if index is None:
+            return
+        if changes is None or index['version'] != old_version:
+            # Rebuild lazily on the next search
+            del _search_indexes[username]
+            return
+        
+        for old_entry, new_entry in changes:
+            if old_entry is not None:
+                _index_entry(index, old_entry, -1)
+            if new_entry is not None:
+                _index_entry(index, new_entry, 1)
+        index['version'] = new_version
+
+ENTRY_CHANGE_HANDLERS.append(_update_search_index)
+
+def parse_search_query(query):
+    """Parse a query into clauses: ('term', t), ('prefix', p) or ('phrase', [t, ...])
+    
+    Words are ANDed together, "double quotes" make a phrase and a trailing *
+    matches any term starting with the word.
+    """
+    clauses = []
+    for match in re.finditer(r'"([^"]*)"?|(\S+)', query):
+        if match.group(1) is not None:
+            terms = tokenize(match.group(1))
+        else:
+            terms = tokenize(match.group(2))
+            if len(terms) == 1 and match.group(2).endswith('*'):
+                clauses.append(('prefix', terms[0]))
+                continue
+        
+        if len(terms) == 1:
+            clauses.append(('term', terms[0]))
+        elif terms:
+            clauses.append(('phrase', terms))
+    return clauses
+
+def _match_clause(index, clause):
+    """Return {entry id: positions matched} for one query clause"""
+    kind, value = clause
+    postings = index['postings']
+    
+    if kind == 'term':
+        return {entry_id: list(positions) for entry_id, positions in postings.get(value, {}).items()}
+    
+    if kind == 'prefix':
+        terms = index['terms']
+        start = bisect.bisect_left(terms, value)
+        matches = {}
+        for term in terms[start:start + SEARCH_PREFIX_MAX_TERMS]:
+            if not term.startswith(value):
+                break
+            for entry_id, positions in postings[term].items():
+                matches.setdefault(entry_id, []).extend(positions)
+        return matches
+    
+    # Phrase: the first term's positions where every following term comes next
+    term_postings = [postings.get(term) for term in value]
+    if not all(term_postings):
+        return {}
+    
+    matches = {}
+    candidates = set(term_postings[0]).intersection(*term_postings[1:])
+    for entry_id in candidates:
+        following = [set(p[entry_id]) for p in term_postings[1:]]
+        starts = [position for position in term_postings[0][entry_id]
+                  if all(position + i + 1 in positions for i, positions in enumerate(following))]
+        if starts:
+            matches[entry_id] = [start + i for start in starts for i in range(len(value))]
+    return matches
+
+def _search_index(username):
+    """Return the user's search index for the current data, building it if needed"""
+    version = _entries_version(username)
+    with _search_lock:
+        index = _search_indexes.get(username)
+        if index is not None and index['version'] == version:
+            _search_indexes.move_to_end(username)
+            return index
+    
+    entries, version = _load_user_entries(username)
+    index = build_search_index(entries, version)
+    with _search_lock:
+        _search_indexes[username] = index
+        _search_indexes.move_to_end(username)
+        while len(_search_indexes) > SEARCH_INDEX_MAX_USERS:
+            _search_indexes.popitem(last=False)
+    return index
+
+def search_user_entries(username, query, limit=ENTRIES_PER_PAGE, offset=0):
+    """Search a user's entries
+    
+    Returns (total matches, [(entry id, score, matched positions), ...]) for
+    the requested page, best matches first (BM25), newest first on ties.
+    """
+    clauses = parse_search_query(query)
+    if not clauses:
+        return 0, []
+    
+    index = _search_index(username)
+    with _search_lock:
+        doc_count = len(index['docs'])
+        if not doc_count:
+            return 0, []
+        avg_length = index['total_length'] / doc_count
+        
+        scores = None
+        positions = {}
+        for clause in clauses:
+            matches = _match_clause(index, clause)
+            
+            # Every clause has to match
+            entry_ids = matches.keys() if scores is None else scores.keys() & matches.keys()
+            idf = np.log(1 + (doc_count - len(matches) + 0.5) / (len(matches) + 0.5))
+            
+            clause_length = len(clause[1]) if clause[0] == 'phrase' else 1
+            new_scores = {}
+            for entry_id in entry_ids:
+                frequency = len(matches[entry_id]) / clause_length
+                length = index['docs'][entry_id][0]
+                bm25 = idf * frequency * 2.2 / (frequency + 1.2 * (0.25 + 0.75 * length / avg_length))
+                new_scores[entry_id] = (0 if scores is None else scores[entry_id]) + bm25
+                positions.setdefault(entry_id, []).extend(matches[entry_id])
+            scores = new_scores
+        
+        ranked = sorted(scores, key=lambda entry_id: (scores[entry_id], index['docs'][entry_id][1], entry_id),
+                        reverse=True)
+    
+    page = [(entry_id, float(scores[entry_id]), sorted(set(positions[entry_id])))
+            for entry_id in ranked[offset:offset + limit]]
+    return len(ranked), page
+
+def search_snippet(text, positions):
+    """Return an HTML snippet of text around the first match, with matches in <mark>"""
+    tokens = list(TOKEN_PATTERN.finditer(text))
+    highlight = set(positions)
+    
+    if not tokens:
+        return Markup.escape(text)
+    
+    first = positions[0] if positions else 0
+    start = max(first - SEARCH_SNIPPET_TOKENS // 3, 0)
+    end = min(start + SEARCH_SNIPPET_TOKENS, len(tokens))
+    
+    snippet = Markup("…") if start > 0 else Markup()
+    cursor = tokens[start].start()
+    for position in range(start, end):
+        token = tokens[position]
+        snippet += text[cursor:token.start()]
+        if position in highlight:
+            snippet += Markup("<mark>%s</mark>") % token.group()
+        else:
+            snippet += token.group()
+        cursor = token.end()
+    if end < len(tokens):
+        snippet += Markup("…")
+    else:
+        snippet += text[cursor:]
+    return snippet
+
+def parse_date_arg(value):
+    """Return value if it is a YYYY-MM-DD date, otherwise None"""
+    try:
+        datetime.datetime.strptime(value, '%Y-%m-%d')
+        return value
+    except (TypeError, ValueError):
+        return None
+
+def parse_month_arg(value):
+    """Return the first and last day of a YYYY-MM month, or None"""
+    try:
+        first = datetime.datetime.strptime(value, '%Y-%m').date()
+    except (TypeError, ValueError):
+        return None
+    last = first.replace(day=calendar.monthrange(first.year, first.month)[1])
+    return first.isoformat(), last.isoformat()
+
+def parse_entry_cursor(value):
+    """Parse a "YYYY-MM-DD:id" pagination cursor into (date, id), or None"""
+    if not value or ':' not in value:
+        return None
+    date, _, entry_id = value.partition(':')
+    if not parse_date_arg(date) or not entry_id.isdigit():
+        return None
+    return date, int(entry_id)
+
+def next_entry_id(username):
+    """Return an id for a new entry that doesn't collide with existing ones"""
+    if STORAGE_BACKEND == 'sqlite':
+        row = get_db().execute(
+            "SELECT MAX(id) AS max_id FROM entries WHERE username = ?", (username,)).fetchone()
+        max_id = row['max_id']
+    else:
+        entries, _ = _load_user_entries(username)
+        max_id = max((entry.id for entry in entries), default=None)
+    
+    new_id = int(datetime.datetime.now().timestamp())
+    if max_id is not None:
+        new_id = max(new_id, max_id + 1)
+    return new_id
+
+# Users are kept in users.json (or the users table). The JSON store keeps
+# the parsed file in memory, so logins and page views look users up in a dict
+# instead of re-reading the file. The file's mtime/size/inode are re-checked
+# at most every USERS_RECHECK_SECONDS to pick up writes from other worker
+# processes. Writes take an exclusive lock on users.json.lock (flock, plus a
+# thread lock within the process), re-read the file, apply the change and
+# atomically replace the file, so concurrent registrations can't drop users.
+USERS_FILE = "users.json"
+USERS_RECHECK_SECONDS = 1.0
+_users_cache = {"stat": None, "checked": 0.0, "users": {}}
+_users_lock = threading.RLock()
+
+def _users_file_stat():
+    try:
+        stat = os.stat(USERS_FILE)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+def _load_users(force=False):
+    """Return the cached users dict, re-reading users.json if it changed"""
+    with _users_lock:
+        now = time.monotonic()
+        if not force and now - _users_cache['checked'] < USERS_RECHECK_SECONDS:
+            return _users_cache['users']
+        
+        stat = _users_file_stat()
+        if force or stat != _users_cache['stat']:
+            users = {}
+            if stat is not None:
+                with open(USERS_FILE, "r") as f:
+                    users = json.load(f)
+            _users_cache['users'] = users
+            _users_cache['stat'] = stat
+        _users_cache['checked'] = now
+        return _users_cache['users']
+
+def _modify_users(change):
+    """Apply change(users) to the JSON user store under the lock, returning its result"""
+    with _users_lock, file_lock(USERS_FILE + ".lock"):
+        # Start from what is on disk, not the cache, in case another process wrote
+        users = dict(_load_users(force=True))
+        result = change(users)
+        if result is not False:
+            atomic_write_json(USERS_FILE, users)
+            _users_cache['users'] = users
+            _users_cache['stat'] = _users_file_stat()
+            _users_cache['checked'] = time.monotonic()
+        return result
+
+def get_users():
+    """Load all users as a dict of username -> {"name", "password"}"""
+    if STORAGE_BACKEND == 'sqlite':
+        rows = get_db().execute("SELECT * FROM users")
+        return {row['username']: {"name": row['name'], "password": row['password']} for row in rows}
+    
+    return {username: dict(user) for username, user in _load_users().items()}
+
+def get_user(username):
+    """Load a single user record, or None if the user doesn't exist"""
+    if STORAGE_BACKEND == 'sqlite':
+        row = get_db().execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
+        return {"name": row['name'], "password": row['password']} if row else None
+    
+    user = _load_users().get(username)
+    return dict(user) if user else None
+
+def create_user(username, user):
+    """Add a new user, returning False if the username is already taken"""
+    if STORAGE_BACKEND == 'sqlite':
+        db = get_db()
+        try:
+            with db:
+                db.execute("INSERT INTO users (username, name, password) VALUES (?, ?, ?)",
+                           (username, user['name'], user['password']))
+        except sqlite3.IntegrityError:
+            return False
+        return True
+    
+    def add(users):
+        if username in users:
+            return False
+        users[username] = dict(user)
+        return True
+    
+    return _modify_users(add)
+
+def save_user(username, user):
+    """Create or update a user record"""
+    if STORAGE_BACKEND == 'sqlite':
+        db = get_db()
+        with db:
+            db.execute(
+                "INSERT INTO users (username, name, password) VALUES (?, ?, ?) "
+                "ON CONFLICT (username) DO UPDATE SET name = excluded.name, password = excluded.password",
+                (username, user['name'], user['password']))
+        return
+    
+    def replace(users):
+        users[username] = dict(user)
+    
+    _modify_users(replace)
+
+# Building a SentimentIntensityAnalyzer parses the whole VADER lexicon, so the
+# process keeps a single instance and shares it between request threads.
+_sentiment_analyzer = None
+_sentiment_analyzer_lock = threading.Lock()
+
+def get_sentiment_analyzer():
+    """Return the shared sentiment analyzer, creating it on first use"""
+    global _sentiment_analyzer
+    
+    if _sentiment_analyzer is None:
+        with _sentiment_analyzer_lock:
+            # Another thread may have created it while we were waiting
+            if _sentiment_analyzer is None:
+                _sentiment_analyzer = SentimentIntensityAnalyzer()
+    
+    return _sentiment_analyzer
+
+def mood_from_compound(compound):
+    """Map a VADER compound score to a mood label"""
+    if compound >= 0.05:
         return "Positive"
-    elif sentiment['compound'] <= -0.05:
+    elif compound <= -0.05:
         return "Negative"
     else:
         return "Neutral"
 
-def calculate_streak(entries):
-    """Calculate the current streak"""
-    if not entries:
-        return 0
+# Entries are scored sentence by sentence. Each sentence's VADER scores are
+# kept in a process-wide cache keyed by a hash of the sentence, and stored on
+# the entry ("sentences": [{"hash", "compound", "pos", "neg", "neu"}]) next to
+# the length-weighted aggregate ("sentiment"). Re-scoring an edited entry only
+# runs VADER on the sentences whose hash isn't already known. Emoji are
+# replaced by words from the VADER lexicon before scoring; plain emoticons
+# like :) and :( are already in the lexicon. Bump SENTIMENT_VERSION when
+# scoring changes so that stored sentence scores are not reused.
+SENTIMENT_VERSION = 1
+SENTENCE_CACHE_MAX = 20000
+SENTENCE_PATTERN = re.compile(r'[^.!?\n]*[.!?]+|[^.!?\n]+')
+EMOJI_SENTIMENT = {
+    "😀": "happy", "😃": "happy", "😄": "happy", "😁": "happy", "😊": "happy", "🙂": "smile",
+    "😆": "laugh", "😂": "laugh", "🤣": "laugh", "😍": "love", "🥰": "love", "😘": "love",
+    "❤": "love", "❤️": "love", "💕": "love", "💖": "love", "👍": "good", "🎉": "celebrate",
+    "😎": "cool", "🤗": "hug", "😌": "relieved", "🥳": "celebrate", "✨": "wonderful",
+    "😐": "meh", "😑": "meh", "🤔": "wonder", "😴": "tired", "😶": "meh",
+    "😕": "confused", "🙁": "sad", "☹": "sad", "☹️": "sad", "😞": "disappointed", "😔": "sad",
+    "😢": "cry", "😭": "cry", "😿": "sad", "😟": "worried", "😰": "anxious", "😨": "scared",
+    "😱": "scared", "😠": "angry", "😡": "angry", "🤬": "angry", "💔": "heartbroken",
+    "👎": "bad", "😩": "miserable", "😫": "miserable", "🤢": "disgusted", "🤒": "sick",
+}
+EMOJI_PATTERN = re.compile("|".join(sorted(map(re.escape, EMOJI_SENTIMENT), key=len, reverse=True)))
+_sentence_scores = OrderedDict()  # sentence hash -> scores
+_sentence_scores_lock = threading.Lock()
+
+def split_sentences(text):
+    """Split text into sentences on ., !, ? and line breaks"""
+    return [sentence.strip() for sentence in SENTENCE_PATTERN.findall(text) if sentence.strip()]
+
+def sentence_hash(sentence):
+    return hashlib.sha1(f"{SENTIMENT_VERSION}:{sentence}".encode('utf-8')).hexdigest()[:16]
+
+def score_sentence(sentence):
+    """Return VADER's compound/pos/neg/neu scores for one sentence, emoji included"""
+    text = EMOJI_PATTERN.sub(lambda match: f" {EMOJI_SENTIMENT[match.group()]} ", sentence)
+    scores = get_sentiment_analyzer().polarity_scores(text)
+    return {key: scores[key] for key in ('compound', 'pos', 'neg', 'neu')}
+
+def _remember_sentence_scores(key, scores):
+    with _sentence_scores_lock:
+        _sentence_scores[key] = scores
+        _sentence_scores.move_to_end(key)
+        while len(_sentence_scores) > SENTENCE_CACHE_MAX:
+            _sentence_scores.popitem(last=False)
+
+SENTIMENT_FIELDS = ('compound', 'pos', 'neg', 'neu')
+
+@span('sentiment.score')
+def analyze_sentiment(text, previous=None):
+    """Score text sentence by sentence
+    
+    previous is the "sentences" list stored on an earlier version of the
+    entry; sentences that haven't changed reuse its scores. Returns
+    {"sentiment": aggregate scores, "sentences": per-sentence scores}.
+    """
+    known = {item['hash']: item for item in previous or ()}
+    
+    sentences = []
+    scored = []
+    for sentence in split_sentences(text):
+        key = sentence_hash(sentence)
+        scores = known.get(key)
+        if scores is None:
+            with _sentence_scores_lock:
+                scores = _sentence_scores.get(key)
+        if scores is None:
+            scores = score_sentence(sentence)
+        scores = {name: scores[name] for name in SENTIMENT_FIELDS}
+        _remember_sentence_scores(key, scores)
+        
+        sentences.append({"hash": key, **scores})
+        scored.append((sentence, scores))
+    
+    return {"sentiment": combine_sentence_scores(scored), "sentences": sentences}
+
+def combine_sentence_scores(scored):
+    """Average (sentence, scores) pairs into text-level scores, weighted by sentence length"""
+    totals = dict.fromkeys(SENTIMENT_FIELDS, 0.0)
+    total_weight = 0
+    for sentence, scores in scored:
+        # Longer sentences count for more in the entry's overall scores
+        weight = max(len(sentence.split()), 1)
+        for name in totals:
+            totals[name] += scores[name] * weight
+        total_weight += weight
+    
+    sentiment = {name: round(value / total_weight, 4) if total_weight else 0.0 for name, value in totals.items()}
+    if not total_weight:
+        sentiment['neu'] = 1.0
+    return sentiment
+
+def score_entry(entry, previous=None):
+    """Set an entry's sentiment, per-sentence scores and mood from its text"""
+    result = analyze_sentiment(entry['text'], previous.get('sentences') if previous else None)
+    entry['sentiment'] = dict(result['sentiment'], version=SENTIMENT_VERSION)
+    entry['sentences'] = result['sentences']
+    entry['mood'] = mood_from_compound(result['sentiment']['compound'])
+    return entry
+
+# Entries saved before scores were stored (or scored with an older
+# SENTIMENT_VERSION) are scored by a background thread, started with the
+# first request, that works through every user SENTIMENT_BACKFILL_BATCH
+# entries at a time. It only holds a user's write lock for one batch, so it
+# never keeps the user waiting for long. `flask backfill-sentiment` does the
+# same in the foreground.
+SENTIMENT_BACKFILL_BATCH = 100
+SENTIMENT_BACKFILL_PAUSE = 0.5  # seconds between batches
+_sentiment_backfill_started = False
+_sentiment_backfill_lock = threading.Lock()
+
+def entry_needs_scoring(entry):
+    return (entry.sentiment or {}).get('version') != SENTIMENT_VERSION
+
+def backfill_user_sentiment(username, batch_size=SENTIMENT_BACKFILL_BATCH, pause=0):
+    """Score a user's unscored entries in batches, returning how many were scored"""
+    scored = 0
+    while True:
+        with user_entries_lock(username):
+            entries, _ = _load_user_entries(username)
+            batch = [entry.to_dict() for entry in entries if entry_needs_scoring(entry)][:batch_size]
+            if not batch:
+                return scored
+            for entry in batch:
+                score_entry(entry, entry)
+            update_user_entries(username, upserts=batch)
+        scored += len(batch)
+        time.sleep(pause)
+
+def entry_usernames():
+    """Return the usernames that have stored entries"""
+    if STORAGE_BACKEND == 'sqlite':
+        rows = get_db().execute("SELECT DISTINCT username FROM entries ORDER BY username")
+        return [row['username'] for row in rows]
+    
+    files = glob.glob("entries_*.json") + glob.glob("entries_*.log")
+    return sorted({os.path.splitext(f)[0][len("entries_"):] for f in files})
+
+def _backfill_sentiment():
+    for username in entry_usernames():
+        try:
+            scored = backfill_user_sentiment(username, pause=SENTIMENT_BACKFILL_PAUSE)
+        except Exception as e:
+            log_event(logging.ERROR, "sentiment.backfill_failed", user=username, error=e)
+            continue
+        if scored:
+            log_event(logging.INFO, "sentiment.backfill", user=username, scored=scored)
+
+def start_sentiment_backfill():
+    """Start the backfill thread once per process"""
+    global _sentiment_backfill_started
+    
+    if _sentiment_backfill_started:
+        return
+    with _sentiment_backfill_lock:
+        if not _sentiment_backfill_started:
+            _sentiment_backfill_started = True
+            threading.Thread(target=_backfill_sentiment, name="sentiment-backfill", daemon=True).start()
+
+# Bulk import of existing journals, from /api/entries/import or `flask
+# import-entries`. Files are NDJSON (one {"date": ..., "text": ...} object
+# per line) or CSV with a header row naming date and text columns. Scoring
+# is the slow part, so large imports are split into chunks that a pool of
+# worker processes scores in parallel (each worker loads the lexicon once).
+# Ids are then allocated and every entry written under the user's write lock
+# in one update, i.e. a single journal append or SQLite transaction.
+IMPORT_FORMATS = ('ndjson', 'csv')
+IMPORT_MAX_BYTES = 50 * 1024 * 1024
+IMPORT_MAX_ENTRIES = 100000
+IMPORT_WORKERS = int(os.environ.get('DIARY_IMPORT_WORKERS', os.cpu_count() or 2))
+IMPORT_CHUNK_SIZE = 250
+IMPORT_PARALLEL_MIN = 500  # below this, starting worker processes costs more than it saves
+_import_executor = None
+_import_executor_lock = threading.Lock()
+
+class EntryImportError(Exception):
+    """An import file that can't be read; line is where the problem was found"""
+    def __init__(self, message, line=None):
+        super().__init__(f"Line {line}: {message}" if line else message)
+        self.line = line
+
+def detect_import_format(filename=None, content_type=None):
+    """Guess the import format from a file name or content type"""
+    if (filename or '').lower().endswith('.csv') or 'csv' in (content_type or ''):
+        return 'csv'
+    return 'ndjson'
+
+def _import_record(record, line):
+    """Check one imported record and turn it into an unscored entry dict"""
+    if not isinstance(record, dict):
+        raise EntryImportError("expected an object with date and text", line)
+    
+    text = str(record.get('text') or '').strip()
+    date = str(record.get('date') or '').strip()
+    if not text:
+        raise EntryImportError("entry has no text", line)
+    try:
+        date = ordinal_date(date_ordinal(date))
+    except ValueError:
+        raise EntryImportError(f"invalid date {date!r}, use YYYY-MM-DD", line)
     
-    # Sort entries by date
-    sorted_entries = sorted(entries, key=lambda x: x['date'], reverse=True)
+    return {"date": date, "text": text, "word_count": len(text.split())}
+
+def parse_import_entries(text, format='ndjson'):
+    """Parse NDJSON or CSV import data into unscored entry dicts"""
+    entries = []
     
-    # Get today's date
-    today = datetime.datetime.now().date()
+    if format == 'csv':
+        reader = csv.DictReader(StringIO(text, newline=''))
+        try:
+            columns = {(name or '').strip().lower() for name in reader.fieldnames or ()}
+            if not {'date', 'text'} <= columns:
+                raise EntryImportError("CSV needs a header row with date and text columns")
+            for row in reader:
+                row = {(key or '').strip().lower(): value for key, value in row.items()}
+                entries.append(_import_record(row, reader.line_num))
+                if len(entries) > IMPORT_MAX_ENTRIES:
+                    raise EntryImportError(f"imports are limited to {IMPORT_MAX_ENTRIES} entries")
+        except csv.Error as e:
+            raise EntryImportError(str(e), reader.line_num)
+        return entries
+    
+    for line_number, line in enumerate(text.splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise EntryImportError("not valid JSON", line_number)
+        entries.append(_import_record(record, line_number))
+        if len(entries) > IMPORT_MAX_ENTRIES:
+            raise EntryImportError(f"imports are limited to {IMPORT_MAX_ENTRIES} entries")
+    return entries
+
+def get_import_executor():
+    """Return the import scoring pool, starting it on first use"""
+    global _import_executor
+    
+    with _import_executor_lock:
+        if _import_executor is None:
+            _import_executor = ProcessPoolExecutor(
+                max_workers=IMPORT_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _import_executor
+
+def _reset_import_executor(executor):
+    """Forget a broken import pool so get_import_executor starts a new one"""
+    global _import_executor
+    
+    with _import_executor_lock:
+        if _import_executor is executor:
+            _import_executor = None
+    executor.shutdown(wait=False)
+
+def _score_import_chunk(entries):
+    """Worker process body: score a chunk of imported entries"""
+    return [score_entry(entry) for entry in entries]
+
+def score_import_entries(entries):
+    """Score imported entries, in parallel across worker processes for large imports"""
+    with span('sentiment.import'):
+        if len(entries) < IMPORT_PARALLEL_MIN or IMPORT_WORKERS < 2:
+            return _score_import_chunk(entries)
+        
+        chunks = [entries[i:i + IMPORT_CHUNK_SIZE] for i in range(0, len(entries), IMPORT_CHUNK_SIZE)]
+        executor = get_import_executor()
+        try:
+            scored = []
+            for chunk in executor.map(_score_import_chunk, chunks):
+                scored.extend(chunk)
+            return scored
+        except BrokenProcessPool:
+            # A worker died: drop the pool so the next import starts a fresh
+            # one, and score this import here instead
+            log_event(logging.WARNING, "import.pool_broken", entries=len(entries))
+            _reset_import_executor(executor)
+            return _score_import_chunk(entries)
+
+def import_user_entries(username, text, format='ndjson'):
+    """Parse, score and store imported entries in one write, returning a summary"""
+    start = time.perf_counter()
+    entries = score_import_entries(parse_import_entries(text, format))
     
-    # Check if there's an entry for today
-    latest_entry_date = datetime.datetime.strptime(sorted_entries[0]['date'], "%Y-%m-%d").date()
-    if latest_entry_date != today:
-        return 0
+    if entries:
+        # Consecutive ids above every existing one, picked under the write
+        # lock so entries saved meanwhile can't take the same ids
+        with user_entries_lock(username):
+            first_id = next_entry_id(username)
+            for offset, entry in enumerate(entries):
+                entry['id'] = first_id + offset
+            update_user_entries(username, upserts=entries)
+    
+    elapsed = time.perf_counter() - start
+    return {
+        "imported": len(entries),
+        "seconds": round(elapsed, 3),
+        "entries_per_second": round(len(entries) / elapsed, 1) if elapsed else None
+    }
+
+def analyze_mood(text):
+    """Analyze the mood of the text using NLTK's sentiment analyzer"""
+    return mood_from_compound(analyze_sentiment(text)['sentiment']['compound'])
+
+def analyze_moods(texts):
+    """Analyze the mood of many texts in one pass with the shared analyzer
+    
+    The batch is split into sentences first, so each distinct sentence is
+    scored once however many texts contain it, and the sentence cache is
+    checked and updated once for the whole batch.
+    """
+    split_texts = [[(sentence, sentence_hash(sentence)) for sentence in split_sentences(text)]
+                   for text in texts]
+    unique = {key: sentence for sentences in split_texts for sentence, key in sentences}
+    
+    with _sentence_scores_lock:
+        known = {key: _sentence_scores[key] for key in unique if key in _sentence_scores}
+    new_scores = {}
+    for key, sentence in unique.items():
+        if key not in known:
+            scores = score_sentence(sentence)
+            new_scores[key] = {name: scores[name] for name in SENTIMENT_FIELDS}
+    for key, scores in new_scores.items():
+        _remember_sentence_scores(key, scores)
+    known.update(new_scores)
+    
+    return [
+        mood_from_compound(combine_sentence_scores(
+            [(sentence, known[key]) for sentence, key in sentences])['compound'])
+        for sentences in split_texts
+    ]
+
+def calculate_streak(entry_dates):
+    """Calculate the current streak of consecutive days with entries, ending today
     
-    # Count consecutive days
-    streak = 1
-    for i in range(1, len(sorted_entries)):
-        prev_date = datetime.datetime.strptime(sorted_entries[i-1]['date'], "%Y-%m-%d").date()
-        curr_date = datetime.datetime.strptime(sorted_entries[i]['date'], "%Y-%m-%d").date()
-        
-        # Check if dates are consecutive
-        if (prev_date - curr_date).days == 1:
-            streak += 1
-        else:
-            break
+    entry_dates is a collection (set, dict keys) of YYYY-MM-DD strings.
+    """
+    day = datetime.datetime.now().date()
+    
+    # Count consecutive days back from today
+    streak = 0
+    while day.isoformat() in entry_dates:
+        streak += 1
+        day -= datetime.timedelta(days=1)
     
     return streak
 
 def calculate_mood(entries):
-    """Calculate overall mood based on recent entries"""
+    """Calculate overall mood based on recent entries (Entry objects, newest first)"""
     if not entries or len(entries) < 3:
         return "Neutral"
     
     # Get recent entries
     recent_entries = entries[:5] if len(entries) >= 5 else entries
     
-    # Count moods
-    moods = [entry['mood'] for entry in recent_entries]
-    positive_count = moods.count("Positive")
-    negative_count = moods.count("Negative")
-    neutral_count = moods.count("Neutral")
-    
-    # Determine overall mood
-    if positive_count > negative_count and positive_count > neutral_count:
-        return "Positive"
-    elif negative_count > positive_count and negative_count > neutral_count:
-        return "Negative"
+    # Average the stored compound scores
+    average = sum(entry_compound(entry) for entry in recent_entries) / len(recent_entries)
+    return mood_from_compound(average)
+
+# Rendered charts are cached by a hash of the data each chart actually draws,
+# so repeat page views serve the same PNG bytes without touching matplotlib.
+# The in-memory cache is bounded by CHART_CACHE_MAX_BYTES; setting
+# DIARY_CHART_CACHE_DIR also keeps rendered charts on disk across restarts.
+# Bump CHART_STYLE_VERSION whenever the drawing code changes.
+CHART_STYLE_VERSION = 3
+CHART_CACHE_MAX_BYTES = 32 * 1024 * 1024
+CHART_CACHE_DIR = os.environ.get('DIARY_CHART_CACHE_DIR')
+CHART_CACHE_DIR_MAX_FILES = 2000
+_chart_cache = OrderedDict()  # key -> PNG bytes
+_chart_cache_bytes = 0
+_chart_cache_lock = threading.Lock()
+
+def chart_cache_key(kind, data):
+    """Hash a chart's kind and input data into a cache key"""
+    payload = json.dumps([CHART_STYLE_VERSION, kind, data], separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def _remember_chart(key, png):
+    """Add a rendered chart to the in-memory cache, evicting the oldest charts"""
+    global _chart_cache_bytes
+    
+    with _chart_cache_lock:
+        if key in _chart_cache or len(png) > CHART_CACHE_MAX_BYTES:
+            return
+        
+        _chart_cache[key] = png
+        _chart_cache_bytes += len(png)
+        
+        while _chart_cache_bytes > CHART_CACHE_MAX_BYTES:
+            _, old_png = _chart_cache.popitem(last=False)
+            _chart_cache_bytes -= len(old_png)
+
+def _prune_chart_cache_dir():
+    """Remove the oldest charts from the on-disk cache once it has too many files"""
+    paths = glob.glob(os.path.join(CHART_CACHE_DIR, "*.png"))
+    if len(paths) <= CHART_CACHE_DIR_MAX_FILES:
+        return
+    
+    paths.sort(key=lambda path: os.stat(path).st_mtime)
+    for path in paths[:len(paths) - CHART_CACHE_DIR_MAX_FILES]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def get_cached_chart(kind, data, render):
+    """Return PNG bytes for a chart, calling render(data) only on a cache miss"""
+    key = chart_cache_key(kind, data)
+    
+    with _chart_cache_lock:
+        png = _chart_cache.get(key)
+        if png is not None:
+            _chart_cache.move_to_end(key)
+            return png
+    
+    disk_path = os.path.join(CHART_CACHE_DIR, f"{key}.png") if CHART_CACHE_DIR else None
+    if disk_path and os.path.exists(disk_path):
+        with open(disk_path, "rb") as f:
+            png = f.read()
     else:
-        return "Neutral"
+        with span(f'chart.{kind}'):
+            png = render(data)
+        
+        if disk_path:
+            os.makedirs(CHART_CACHE_DIR, exist_ok=True)
+            temp_path = f"{disk_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(png)
+            os.replace(temp_path, disk_path)
+            _prune_chart_cache_dir()
+    
+    _remember_chart(key, png)
+    return png
+
+def _figure_to_png(fig):
+    """Render a matplotlib figure to PNG bytes and close it"""
+    buffer = BytesIO()
+    fig.savefig(buffer, format='png')
+    image_png = buffer.getvalue()
+    buffer.close()
+    plt.close(fig)
+    return image_png
 
-def generate_mood_chart(entries):
-    """Generate mood chart as base64 image showing daily average mood with custom emoji-like markers"""
+def mood_chart_png(entries):
+    """Return the daily mood chart as PNG bytes, or None if there aren't enough entries"""
     if not entries or len(entries) < 3:
         return None
     
+    return mood_chart_png_for_days(build_user_stats(entries)['days'])
+
+def mood_chart_png_for_days(days):
+    """Return the daily mood chart for per-day [entry count, compound sum] aggregates"""
+    daily_moods = [[date, round(compound_sum / count, 4)] for date, (count, compound_sum) in sorted(days.items())]
+    return get_cached_chart('mood', daily_moods, _render_mood_chart)
+
+# Long histories are averaged into weekly, then monthly (or wider) buckets so
+# the mood chart never draws more than MOOD_CHART_MAX_POINTS faces
+MOOD_CHART_MAX_POINTS = 120
+
+def _bucket_moods(dates, moods):
+    """Average daily moods into weekly or monthly buckets if there are too many days"""
+    if len(dates) <= MOOD_CHART_MAX_POINTS:
+        return dates, moods, 'Daily'
+    
+    # Weeks start on Monday (1970-01-01 was a Thursday)
+    days = dates.astype('int64')
+    week_starts = (days - (days + 3) % 7).astype('datetime64[D]')
+    buckets, label = week_starts, 'Weekly'
+    
+    if len(np.unique(week_starts)) > MOOD_CHART_MAX_POINTS:
+        months = dates.astype('datetime64[M]').astype('int64')
+        step = max(1, -(-(months.max() - months.min() + 1) // MOOD_CHART_MAX_POINTS))
+        buckets = (months - (months - months.min()) % step).astype('datetime64[M]').astype('datetime64[D]')
+        label = 'Monthly'
+    
+    bucket_dates, inverse = np.unique(buckets, return_inverse=True)
+    totals = np.bincount(inverse, weights=moods)
+    counts = np.bincount(inverse)
+    return bucket_dates, totals / counts, label
+
+def _render_mood_chart(daily_moods):
+    """Draw the daily mood chart with custom emoji-like markers"""
     # Create figure and axis
     fig, ax = plt.subplots(figsize=(10, 5))
     
-    # Group entries by date and calculate average mood
-    date_moods = {}
-    
-    for entry in entries:
-        date = entry['date']
-        
-        # Convert mood to numeric value
-        if entry['mood'] == "Positive":
-            mood_value = 1
-        elif entry['mood'] == "Neutral":
-            mood_value = 0
-        else:  # Negative
-            mood_value = -1
-        
-        # Add to date_moods dictionary
-        if date in date_moods:
-            date_moods[date].append(mood_value)
-        else:
-            date_moods[date] = [mood_value]
+    dates = np.array([date for date, _ in daily_moods], dtype='datetime64[D]')
+    moods = np.array([mood for _, mood in daily_moods], dtype=float)
+    dates, moods, period = _bucket_moods(dates, moods)
     
-    # Calculate daily averages
-    dates = []
-    avg_moods = []
-    markers = []
-    colors = []
+    x = matplotlib.dates.date2num(dates)
+    # Same thresholds as mood_from_compound
+    positive = moods >= 0.05
+    negative = moods <= -0.05
+    neutral = ~(positive | negative)
     
-    for date, moods in sorted(date_moods.items()):
-        date_obj = datetime.datetime.strptime(date, "%Y-%m-%d")
-        avg_mood = sum(moods) / len(moods)
-        
-        dates.append(date_obj)
-        avg_moods.append(avg_mood)
-        
-        # Assign marker and color based on mood
-        if avg_mood >= 0.5:  # Positive
-            markers.append('o')  # Circle for face
-            colors.append('#2ecc71')  # Green
-        elif avg_mood <= -0.5:  # Negative
-            markers.append('o')  # Circle for face
-            colors.append('#e74c3c')  # Red
-        else:  # Neutral
-            markers.append('o')  # Circle for face
-            colors.append('#f39c12')  # Orange
+    # Assign color based on mood: green, red or orange
+    colors = np.where(positive, '#2ecc71', np.where(negative, '#e74c3c', '#f39c12'))
     
     # Plot line connecting the points
-    ax.plot(dates, avg_moods, linestyle='-', color='#4a6fa5', linewidth=2, alpha=0.7)
-    
-    # Plot emoji-like markers for each mood
-    for i, (date, mood) in enumerate(zip(dates, avg_moods)):
-        # Plot the face (circle)
-        ax.plot(date, mood, marker=markers[i], markersize=15, color=colors[i], markeredgecolor='black', markeredgewidth=1)
-        
-        # Add eyes and mouth based on mood
-        if mood >= 0.5:  # Positive - happy face
-            # Add smile (arc)
-            arc_radius = 0.05
-            arc_center = (matplotlib.dates.date2num(date), mood - 0.02)
-            arc = matplotlib.patches.Arc(arc_center, arc_radius, arc_radius, 
-                                        theta1=0, theta2=180, color='black', linewidth=1.5)
-            ax.add_patch(arc)
-            
-            # Add eyes
-            left_eye_x = matplotlib.dates.date2num(date) - 0.02
-            right_eye_x = matplotlib.dates.date2num(date) + 0.02
-            eye_y = mood + 0.02
-            ax.plot(left_eye_x, eye_y, 'ko', markersize=3)
-            ax.plot(right_eye_x, eye_y, 'ko', markersize=3)
-            
-        elif mood <= -0.5:  # Negative - sad face
-            # Add frown (arc)
-            arc_radius = 0.05
-            arc_center = (matplotlib.dates.date2num(date), mood + 0.02)
-            arc = matplotlib.patches.Arc(arc_center, arc_radius, arc_radius, 
-                                        theta1=180, theta2=360, color='black', linewidth=1.5)
-            ax.add_patch(arc)
-            
-            # Add eyes
-            left_eye_x = matplotlib.dates.date2num(date) - 0.02
-            right_eye_x = matplotlib.dates.date2num(date) + 0.02
-            eye_y = mood + 0.02
-            ax.plot(left_eye_x, eye_y, 'ko', markersize=3)
-            ax.plot(right_eye_x, eye_y, 'ko', markersize=3)
-            
-        else:  # Neutral - neutral face
-            # Add straight mouth
-            mouth_left_x = matplotlib.dates.date2num(date) - 0.02
-            mouth_right_x = matplotlib.dates.date2num(date) + 0.02
-            mouth_y = mood - 0.02
-            ax.plot([mouth_left_x, mouth_right_x], [mouth_y, mouth_y], 'k-', linewidth=1.5)
-            
-            # Add eyes
-            left_eye_x = matplotlib.dates.date2num(date) - 0.02
-            right_eye_x = matplotlib.dates.date2num(date) + 0.02
-            eye_y = mood + 0.02
-            ax.plot(left_eye_x, eye_y, 'ko', markersize=3)
-            ax.plot(right_eye_x, eye_y, 'ko', markersize=3)
+    ax.plot(x, moods, linestyle='-', color='#4a6fa5', linewidth=2, alpha=0.7)
+    
+    # Plot the faces (circles) in one call
+    ax.scatter(x, moods, s=15 ** 2, c=colors, edgecolors='black', linewidths=1, zorder=3)
+    
+    # Add eyes to every face
+    ax.scatter(np.concatenate([x - 0.02, x + 0.02]), np.tile(moods + 0.02, 2),
+               s=3 ** 2, c='black', zorder=4)
+    
+    # Add mouths: a smile arc for positive, a frown arc for negative and a
+    # straight line for neutral faces, all drawn as one LineCollection
+    theta = np.linspace(0, np.pi, 12)
+    arc_radius = 0.025
+    smiles = np.stack([
+        x[positive, None] + arc_radius * np.cos(theta),
+        moods[positive, None] - 0.02 + arc_radius * np.sin(theta)
+    ], axis=-1)
+    frowns = np.stack([
+        x[negative, None] + arc_radius * np.cos(theta + np.pi),
+        moods[negative, None] + 0.02 + arc_radius * np.sin(theta + np.pi)
+    ], axis=-1)
+    flat = np.linspace(-0.02, 0.02, len(theta))
+    straight = np.stack([
+        x[neutral, None] + flat,
+        np.repeat(moods[neutral, None] - 0.02, len(theta), axis=1)
+    ], axis=-1)
+    mouths = np.concatenate([smiles, frowns, straight])
+    ax.add_collection(LineCollection(mouths, colors='black', linewidths=1.5, zorder=4))
     
     # Add horizontal lines for mood levels
     ax.axhline(y=0, color='#cccccc', linestyle='-', alpha=0.5)
@@ -246,7 +2088,7 @@ def generate_mood_chart(entries):
     ax.set_ylim(-1.5, 1.5)
     ax.set_yticks([-1, 0, 1])
     ax.set_yticklabels(['Negative', 'Neutral', 'Positive'])
-    ax.set_title('Daily Mood Trends')
+    ax.set_title(f'{period} Mood Trends')
     
     # Format x-axis dates
     date_locator = matplotlib.dates.AutoDateLocator()
@@ -267,47 +2109,21 @@ def generate_mood_chart(entries):
     ax.legend(handles=legend_elements, loc='upper right')
     
     # Adjust layout
-    plt.tight_layout()
-    
-    # Convert plot to base64 string
-    buffer = BytesIO()
-    plt.savefig(buffer, format='png')
-    buffer.seek(0)
-    image_png = buffer.getvalue()
-    buffer.close()
-    plt.close(fig)
+    fig.tight_layout()
     
-    return base64.b64encode(image_png).decode('utf-8')
+    return _figure_to_png(fig)
 
-def generate_word_frequency_chart(entries):
-    """Generate word frequency chart as base64 image"""
-    if not entries or len(entries) < 3:
-        return None
-    
-    # Get all text from entries
-    all_text = " ".join([entry['text'] for entry in entries])
-    
-    # Remove common words and punctuation
-    common_words = {'the', 'and', 'to', 'a', 'of', 'in', 'i', 'is', 'that', 'it', 'for', 'on', 'with', 'as', 'was', 'be', 'this', 'have', 'are', 'not', 'but', 'at', 'from', 'or', 'an', 'my', 'by', 'they', 'you', 'we', 'their', 'his', 'her', 'she', 'he', 'had', 'has', 'been', 'were', 'would', 'could', 'should', 'will', 'can', 'do', 'does', 'did', 'just', 'me', 'them', 'so', 'what', 'who', 'when', 'where', 'why', 'how', 'which', 'there', 'here', 'am', 'if', 'then', 'than', 'your', 'our', 'us', 'very', 'much', 'more', 'most', 'some', 'any', 'all', 'no', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten'}
-    
-    # Clean text and split into words
-    words = re.findall(r'\b[a-zA-Z]{3,}\b', all_text.lower())
-    words = [word for word in words if word not in common_words]
-    
-    # Count word frequency
-    word_counts = {}
-    for word in words:
-        if word in word_counts:
-            word_counts[word] += 1
-        else:
-            word_counts[word] = 1
+def word_frequency_chart_png_for_counts(word_counts):
+    """Return the chart of the 10 most common words in a word -> count mapping"""
+    most_common = top_words(word_counts)
     
-    # Get top 10 words
-    top_words = sorted(word_counts.items(), key=lambda x: x[1], reverse=True)[:10]
-    
-    if not top_words:
+    if not most_common:
         return None
     
+    return get_cached_chart('words', [list(item) for item in most_common], _render_word_frequency_chart)
+
+def _render_word_frequency_chart(top_words):
+    """Draw the most common words as a horizontal bar chart"""
     # Create figure and axis
     fig, ax = plt.subplots(figsize=(10, 5))
     
@@ -322,37 +2138,29 @@ def generate_word_frequency_chart(entries):
     ax.set_title('Most Common Words')
     
     # Adjust layout
-    plt.tight_layout()
+    fig.tight_layout()
     
-    # Convert plot to base64 string
-    buffer = BytesIO()
-    plt.savefig(buffer, format='png')
-    buffer.seek(0)
-    image_png = buffer.getvalue()
-    buffer.close()
-    plt.close(fig)
-    
-    return base64.b64encode(image_png).decode('utf-8')
+    return _figure_to_png(fig)
 
-def generate_patterns_chart(entries):
-    """Generate writing patterns chart as base64 image"""
+def patterns_chart_png(entries):
+    """Return the writing patterns chart for an ordered Entry list as PNG bytes, or None if there aren't enough entries"""
     if not entries or len(entries) < 5:
         return None
     
+    # Get data for chart - word count over time (entries are already in date order)
+    points = [[entry.ordinal, entry.word_count] for entry in entries]
+    
+    return get_cached_chart('patterns', points, _render_patterns_chart)
+
+def _render_patterns_chart(points):
+    """Draw word count over time"""
     # Create figure and axis
     fig, ax = plt.subplots(figsize=(10, 5))
     
-    # Get data for chart - word count over time
-    dates = []
-    word_counts = []
-    
-    # Sort entries by date
-    sorted_entries = sorted(entries, key=lambda x: x['date'])
-    
-    for entry in sorted_entries:
-        date_obj = datetime.datetime.strptime(entry['date'], "%Y-%m-%d")
-        dates.append(date_obj)
-        word_counts.append(entry['word_count'])
+    # Ordinals to dates without parsing any strings
+    ordinals = np.array([ordinal for ordinal, _ in points])
+    dates = (ordinals - UNIX_EPOCH_ORDINAL).astype('datetime64[D]')
+    word_counts = [word_count for _, word_count in points]
     
     # Plot data
     ax.plot(dates, word_counts, marker='o', linestyle='-', color='#166088')
@@ -362,31 +2170,61 @@ def generate_patterns_chart(entries):
     ax.set_title('Writing Patterns Over Time')
     
     # Format x-axis dates
-    plt.gcf().autofmt_xdate()
+    fig.autofmt_xdate()
     
     # Adjust layout
-    plt.tight_layout()
+    fig.tight_layout()
     
-    # Convert plot to base64 string
-    buffer = BytesIO()
-    plt.savefig(buffer, format='png')
-    buffer.seek(0)
-    image_png = buffer.getvalue()
-    buffer.close()
-    plt.close(fig)
+    return _figure_to_png(fig)
+
+class LazyFlowables:
+    """List-like view over a flowable generator for doc.build
+    
+    ReportLab consumes the flowables list from the front (len, indexing,
+    del flowables[0], re-inserting split pieces), so pulling flowables from a
+    generator a small window at a time means a large report never holds all
+    of its paragraphs and tables in memory at once.
+    """
+    LOOKAHEAD = 50
+    
+    def __init__(self, flowables):
+        self._source = iter(flowables)
+        self._buffer = []
+    
+    def _fill(self):
+        while self._source is not None and len(self._buffer) < self.LOOKAHEAD:
+            try:
+                self._buffer.append(next(self._source))
+            except StopIteration:
+                self._source = None
+    
+    def __len__(self):
+        self._fill()
+        return len(self._buffer)
+    
+    def __getitem__(self, index):
+        self._fill()
+        return self._buffer[index]
+    
+    def __setitem__(self, index, value):
+        self._fill()
+        self._buffer[index] = value
     
-    return base64.b64encode(image_png).decode('utf-8')
+    def __delitem__(self, index):
+        self._fill()
+        del self._buffer[index]
+    
+    def insert(self, index, value):
+        self._buffer.insert(index, value)
 
 def generate_pdf_report(username, entries, report_type="all"):
-    """Generate a PDF report of diary entries"""
-    # Create a temporary file
-    temp_file = tempfile.NamedTemporaryFile(suffix='.pdf', delete=False)
-    temp_filename = temp_file.name
-    temp_file.close()
+    """Generate a PDF report of diary entries (Entry objects in date order) and return it as bytes"""
+    # Build into memory so nothing is left behind on disk
+    buffer = BytesIO()
     
     # Create the PDF document
     doc = SimpleDocTemplate(
-        temp_filename,
+        buffer,
         pagesize=letter,
         rightMargin=72,
         leftMargin=72,
@@ -394,6 +2232,19 @@ def generate_pdf_report(username, entries, report_type="all"):
         bottomMargin=72
     )
     
+    # Build the PDF, generating the content as the pages are laid out
+    try:
+        doc.build(LazyFlowables(_report_flowables(username, entries, report_type)))
+        return buffer.getvalue()
+    except Exception as e:
+        # This runs in a report worker process, so there is no request to flash to
+        log_event(logging.ERROR, "report.failed", report_type=report_type, error=e)
+        return None
+    finally:
+        buffer.close()
+
+def _report_flowables(username, entries, report_type):
+    """Yield the flowables of a PDF report one at a time"""
     # Get styles
     styles = getSampleStyleSheet()
     title_style = styles['Title']
@@ -429,9 +2280,6 @@ def generate_pdf_report(username, entries, report_type="all"):
         )
     }
     
-    # Create content elements
-    elements = []
-    
     # Add title
     report_date = datetime.datetime.now().strftime("%Y-%m-%d")
     if report_type == "monthly":
@@ -441,90 +2289,82 @@ def generate_pdf_report(username, entries, report_type="all"):
     else:
         title_text = f"Complete Diary Report - {report_date}"
     
-    elements.append(Paragraph(title_text, title_style))
-    elements.append(Spacer(1, 0.25*inch))
+    yield Paragraph(title_text, title_style)
+    yield Spacer(1, 0.25*inch)
     
     # Add user info
-    elements.append(Paragraph(f"User: {username}", normal_style))
-    elements.append(Paragraph(f"Generated on: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", normal_style))
-    elements.append(Paragraph(f"Total Entries: {len(entries)}", normal_style))
-    elements.append(Spacer(1, 0.25*inch))
+    yield Paragraph(f"User: {username}", normal_style)
+    yield Paragraph(f"Generated on: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", normal_style)
+    yield Paragraph(f"Total Entries: {len(entries)}", normal_style)
+    yield Spacer(1, 0.25*inch)
     
     # Add mood chart if available and report type is appropriate
     if report_type in ["all", "mood"] and len(entries) >= 3:
         try:
-            mood_chart_base64 = generate_mood_chart(entries)
-            if mood_chart_base64:
-                # Convert base64 to image data
-                img_data = base64.b64decode(mood_chart_base64)
-                
+            img_data = mood_chart_png(entries)
+            if img_data:
                 # Create a BytesIO object instead of a temporary file
                 img_io = BytesIO(img_data)
                 
                 # Add image to PDF directly from BytesIO
-                elements.append(Paragraph("Mood Trends", heading_style))
-                elements.append(Spacer(1, 0.1*inch))
+                yield Paragraph("Mood Trends", heading_style)
+                yield Spacer(1, 0.1*inch)
                 img = Image(img_io, width=6*inch, height=3*inch)
-                elements.append(img)
-                elements.append(Spacer(1, 0.25*inch))
+                yield img
+                yield Spacer(1, 0.25*inch)
         except Exception as e:
             # If there's an error with the chart, just skip it
-            print(f"Error generating mood chart: {e}")
-            elements.append(Paragraph("Mood chart could not be generated", normal_style))
-            elements.append(Spacer(1, 0.25*inch))
-    
-    # Sort entries by date (newest first)
-    sorted_entries = sorted(entries, key=lambda x: x['date'], reverse=True)
+            log_event(logging.WARNING, "report.chart_failed", error=e)
+            yield Paragraph("Mood chart could not be generated", normal_style)
+            yield Spacer(1, 0.25*inch)
     
     # Filter entries based on report type
     if report_type == "monthly":
-        # Get entries from the current month
-        current_month = datetime.datetime.now().month
-        current_year = datetime.datetime.now().year
-        sorted_entries = [
-            entry for entry in sorted_entries 
-            if datetime.datetime.strptime(entry['date'], '%Y-%m-%d').month == current_month
-            and datetime.datetime.strptime(entry['date'], '%Y-%m-%d').year == current_year
-        ]
-    elif report_type == "mood":
+        # Get entries from the current month by bisecting on the ordinals
+        today = datetime.date.today()
+        month_start = today.replace(day=1).toordinal()
+        next_month = (today.replace(day=28) + datetime.timedelta(days=4)).replace(day=1).toordinal()
+        entries = entries[bisect.bisect_left(entries, month_start, key=entry_day):
+                          bisect.bisect_left(entries, next_month, key=entry_day)]
+    
+    # Entries are in date order; the report lists them newest first
+    sorted_entries = entries[::-1]
+    
+    if report_type == "mood":
         # Group entries by mood
-        elements.append(Paragraph("Entries by Mood", heading_style))
-        elements.append(Spacer(1, 0.1*inch))
+        yield Paragraph("Entries by Mood", heading_style)
+        yield Spacer(1, 0.1*inch)
         
-        for mood in ["Positive", "Neutral", "Negative"]:
-            mood_entries = [entry for entry in sorted_entries if entry['mood'] == mood]
+        for mood in [Mood.POSITIVE, Mood.NEUTRAL, Mood.NEGATIVE]:
+            mood_entries = [entry for entry in sorted_entries if entry.mood == mood]
             if mood_entries:
-                elements.append(Paragraph(f"{mood} Entries ({len(mood_entries)})", styles['Heading2']))
-                elements.append(Spacer(1, 0.1*inch))
+                yield Paragraph(f"{mood.label} Entries ({len(mood_entries)})", styles['Heading2'])
+                yield Spacer(1, 0.1*inch)
                 
                 for entry in mood_entries:
-                    date_obj = datetime.datetime.strptime(entry['date'], '%Y-%m-%d')
-                    formatted_date = date_obj.strftime("%A, %B %d, %Y")
+                    formatted_date = entry.day.strftime("%A, %B %d, %Y")
                     
-                    elements.append(Paragraph(formatted_date, date_style))
-                    elements.append(Paragraph(entry['text'], normal_style))
-                    elements.append(Spacer(1, 0.2*inch))
+                    yield Paragraph(formatted_date, date_style)
+                    yield Paragraph(entry.text, normal_style)
+                    yield Spacer(1, 0.2*inch)
                 
-                elements.append(Spacer(1, 0.1*inch))
+                yield Spacer(1, 0.1*inch)
         
-        # Build the PDF
-        doc.build(elements)
-        return temp_filename
+        return
     
     # Add entries section for all and monthly reports
     if report_type in ["all", "monthly"]:
-        elements.append(Paragraph("Diary Entries", heading_style))
-        elements.append(Spacer(1, 0.1*inch))
+        yield Paragraph("Diary Entries", heading_style)
+        yield Spacer(1, 0.1*inch)
         
         for entry in sorted_entries:
-            date_obj = datetime.datetime.strptime(entry['date'], '%Y-%m-%d')
-            formatted_date = date_obj.strftime("%A, %B %d, %Y")
+            formatted_date = entry.day.strftime("%A, %B %d, %Y")
             
             # Create a table for each entry
             data = [
                 [Paragraph(formatted_date, date_style), 
-                 Paragraph(f"Mood: {entry['mood']}", mood_styles[entry['mood']])],
-                [Paragraph(entry['text'], normal_style), ""]
+                 Paragraph(f"Mood: {entry.mood.label}", mood_styles[entry.mood.label])],
+                [Paragraph(entry.text, normal_style), ""]
             ]
             
             t = Table(data, colWidths=[5*inch, 1*inch])
@@ -537,19 +2377,475 @@ def generate_pdf_report(username, entries, report_type="all"):
                 ('LINEBELOW', (0, 0), (-1, 0), 0.5, colors.lightgrey),
             ]))
             
-            elements.append(t)
-            elements.append(Spacer(1, 0.1*inch))
+            yield t
+            yield Spacer(1, 0.1*inch)
+
+# Speech recognition runs on the server with Vosk, an offline CPU-only
+# recognizer. The model (a directory downloaded from
+# https://alphacephei.com/vosk/models, set with DIARY_STT_MODEL) is loaded once
+# per process and shared by a small pool of transcription threads, so a long
+# clip only ties up STT_WORKERS threads instead of a request thread. Every
+# task on the pool (a chunk of an uploaded clip or of a stream) holds a slot
+# until it finishes, and work beyond the pool plus STT_MAX_PENDING queued
+# tasks is refused with 503 rather than piling up. An upload keeps at most
+# STT_WORKERS of its chunks on the pool at a time, so a long clip doesn't
+# queue ahead of streaming dictation. WAV is decoded directly; WebM/Ogg need
+# ffmpeg.
+STT_MODEL_PATH = os.environ.get('DIARY_STT_MODEL', 'models/vosk-model-small-en-us-0.15')
+STT_SAMPLE_RATE = 16000
+STT_WORKERS = int(os.environ.get('DIARY_STT_WORKERS', '2'))
+STT_MAX_PENDING = 4
+STT_MAX_UPLOAD_BYTES = 25 * 1024 * 1024
+STT_TIMEOUT = 300
+STT_FEED_FRAMES = 4000  # samples handed to the recognizer at a time
+
+_stt_model = None
+_stt_model_lock = threading.Lock()
+_stt_executor = None
+_stt_executor_lock = threading.Lock()
+_stt_slots = threading.BoundedSemaphore(STT_WORKERS + STT_MAX_PENDING)
+
+class SpeechRecognitionError(Exception):
+    """Audio that can't be transcribed; status is the HTTP status to answer with"""
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+def get_stt_model():
+    """Return the shared Vosk model, loading it on first use"""
+    global _stt_model
+    
+    if vosk is None:
+        raise SpeechRecognitionError("Speech recognition is not installed on the server", 503)
+    
+    if _stt_model is None:
+        with _stt_model_lock:
+            if _stt_model is None:
+                if not os.path.isdir(STT_MODEL_PATH):
+                    raise SpeechRecognitionError("Speech recognition model not found", 503)
+                vosk.SetLogLevel(-1)
+                _stt_model = vosk.Model(STT_MODEL_PATH)
+    
+    return _stt_model
+
+def get_stt_executor():
+    """Return the transcription thread pool, starting it on first use"""
+    global _stt_executor
+    
+    if _stt_executor is None:
+        with _stt_executor_lock:
+            if _stt_executor is None:
+                _stt_executor = ThreadPoolExecutor(max_workers=STT_WORKERS, thread_name_prefix="stt")
+    
+    return _stt_executor
+
+def decode_audio(data):
+    """Decode an uploaded clip into float samples in [-1, 1] (frames x channels) and its sample rate"""
+    if data[:4] == b'RIFF' and data[8:12] == b'WAVE':
+        try:
+            with wave.open(BytesIO(data), 'rb') as wav:
+                width, channels, rate = wav.getsampwidth(), wav.getnchannels(), wav.getframerate()
+                raw = wav.readframes(wav.getnframes())
+        except (wave.Error, EOFError):
+            # e.g. floating point WAV, which the wave module can't read
+            pass
+        else:
+            raw = raw[:len(raw) - len(raw) % (width * channels)]
+            if width == 1:
+                samples = (np.frombuffer(raw, np.uint8).astype(np.float32) - 128) / 128
+            elif width == 2:
+                samples = np.frombuffer(raw, '<i2').astype(np.float32) / 32768
+            elif width == 3:
+                b = np.frombuffer(raw, np.uint8).reshape(-1, 3).astype(np.int32)
+                ints = b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)
+                samples = (np.where(ints & 0x800000, ints - 0x1000000, ints) / 8388608).astype(np.float32)
+            else:
+                samples = (np.frombuffer(raw, '<i4') / 2147483648).astype(np.float32)
+            return samples.reshape(-1, channels), rate
     
-    # Build the PDF
+    # Anything else (WebM, Ogg, float WAV) goes through ffmpeg
     try:
-        doc.build(elements)
-        return temp_filename
-    except Exception as e:
-        print(f"Error building PDF: {e}")
-        flash("Error generating PDF report", "error")
+        result = subprocess.run(
+            ['ffmpeg', '-v', 'error', '-i', 'pipe:0', '-f', 'f32le', '-acodec', 'pcm_f32le',
+             '-ac', '1', '-ar', str(STT_SAMPLE_RATE), 'pipe:1'],
+            input=data, capture_output=True, timeout=STT_TIMEOUT)
+    except FileNotFoundError:
+        raise SpeechRecognitionError("Only PCM WAV is supported without ffmpeg", 415)
+    
+    if result.returncode != 0:
+        raise SpeechRecognitionError("Unsupported or corrupt audio file", 415)
+    return np.frombuffer(result.stdout, '<f4').reshape(-1, 1), STT_SAMPLE_RATE
+
+# Before recognition, clips are converted to what the recognizer expects and
+# stripped of silence: downmix to mono, resample to STT_SAMPLE_RATE, normalise
+# the peak level, then drop the frames whose energy stays below the noise
+# floor (energy-based voice activity detection). The remaining speech is cut
+# into chunks of at most STT_CHUNK_SECONDS, preferably at silences, which are
+# recognized in parallel on the pool. Everything is done on whole NumPy
+# arrays, no per-sample Python loops.
+STT_CHUNK_SECONDS = 30
+STT_TARGET_PEAK = 0.9
+STT_MAX_GAIN = 10.0  # don't turn near-silence into loud noise
+STT_VAD_FRAME_SECONDS = 0.03
+STT_VAD_HANGOVER_SECONDS = 0.3  # speech kept around each voiced frame
+STT_VAD_MIN_DBFS = -50.0
+STT_VAD_NOISE_MARGIN_DB = 10.0
+
+def resample_audio(samples, rate, target_rate):
+    """Resample mono samples, low-pass filtering first when downsampling"""
+    if rate == target_rate or not len(samples):
+        return samples
+    
+    if target_rate < rate:
+        # Windowed-sinc filter at the new Nyquist frequency to avoid aliasing
+        taps = np.arange(63) - 31
+        kernel = np.sinc(taps * target_rate / rate) * np.hamming(len(taps))
+        samples = np.convolve(samples, kernel / kernel.sum(), mode='same')
+    
+    count = int(round(len(samples) * target_rate / rate))
+    positions = np.arange(count) * (rate / target_rate)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+def normalise_audio(samples):
+    """Scale samples so the loudest one reaches STT_TARGET_PEAK (gain capped at STT_MAX_GAIN)"""
+    peak = np.max(np.abs(samples)) if len(samples) else 0
+    if peak == 0:
+        return samples
+    return samples * min(STT_TARGET_PEAK / peak, STT_MAX_GAIN)
+
+def detect_speech(samples, rate):
+    """Return (start, end) sample ranges that contain speech"""
+    frame = int(rate * STT_VAD_FRAME_SECONDS)
+    frame_count = -(-len(samples) // frame)
+    if not frame_count:
+        return []
+    
+    frames = np.pad(samples, (0, frame_count * frame - len(samples))).reshape(frame_count, frame)
+    energy_db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+    
+    # Speech is what rises clearly above the quietest frames. A clip with no
+    # quiet frames to compare against (continuous speech, steady background
+    # noise, audio trimmed to the utterance) is kept whole rather than dropped,
+    # as is one where nothing clears the threshold.
+    noise_floor = np.percentile(energy_db, 10)
+    if energy_db.max() - noise_floor < STT_VAD_NOISE_MARGIN_DB:
+        return [(0, len(samples))]
+    threshold = max(noise_floor + STT_VAD_NOISE_MARGIN_DB, STT_VAD_MIN_DBFS)
+    voiced = energy_db > threshold
+    if not voiced.any():
+        return [(0, len(samples))]
+    
+    # Keep a little audio around voiced frames so word edges aren't clipped
+    hangover = int(STT_VAD_HANGOVER_SECONDS / STT_VAD_FRAME_SECONDS)
+    voiced = np.convolve(voiced, np.ones(2 * hangover + 1), mode='same') > 0
+    
+    edges = np.diff(np.concatenate(([0], voiced.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1) * frame
+    ends = np.minimum(np.flatnonzero(edges == -1) * frame, len(samples))
+    return list(zip(starts.tolist(), ends.tolist()))
+
+def chunk_speech(spans, max_samples):
+    """Group speech spans into chunks of at most max_samples, splitting long spans"""
+    chunks = []
+    current = []
+    current_length = 0
+    for start, end in spans:
+        while start < end:
+            if current_length == max_samples:
+                chunks.append(current)
+                current, current_length = [], 0
+            piece_end = min(end, start + max_samples - current_length)
+            if current and piece_end < end:
+                # Start a new chunk rather than cutting this span in two
+                chunks.append(current)
+                current, current_length = [], 0
+                continue
+            current.append((start, piece_end))
+            current_length += piece_end - start
+            start = piece_end
+    if current:
+        chunks.append(current)
+    return chunks
+
+def preprocess_audio(samples, rate):
+    """Turn decoded samples into 16-bit PCM chunks of speech at STT_SAMPLE_RATE
+    
+    Returns ([(pcm bytes, spans)], length of the processed clip in samples),
+    where spans are the (start, end) sample ranges of the clip that make up
+    each chunk.
+    """
+    mono = samples.mean(axis=1) if samples.ndim > 1 else samples
+    mono = normalise_audio(resample_audio(mono, rate, STT_SAMPLE_RATE))
+    
+    chunks = []
+    for spans in chunk_speech(detect_speech(mono, STT_SAMPLE_RATE), STT_CHUNK_SECONDS * STT_SAMPLE_RATE):
+        speech = np.concatenate([mono[start:end] for start, end in spans])
+        pcm = (np.clip(speech, -1, 1) * 32767).astype('<i2').tobytes()
+        chunks.append((pcm, spans))
+    return chunks, len(mono)
+
+def _to_clip_time(seconds, spans):
+    """Map a time within a chunk's speech back to a time in the whole clip"""
+    lengths = np.array([end - start for start, end in spans])
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    position = seconds * STT_SAMPLE_RATE
+    index = min(int(np.searchsorted(offsets, position, side='right')) - 1, len(spans) - 1)
+    return round(float(spans[index][0] + position - offsets[index]) / STT_SAMPLE_RATE, 2)
+
+def _result_segment(result):
+    """Turn a recognizer result into a segment with word timings, or None if empty"""
+    if not result.get('text'):
         return None
+    words = [
+        {"word": w['word'], "start": round(w['start'], 2), "end": round(w['end'], 2),
+         "confidence": round(w.get('conf', 1.0), 3)}
+        for w in result.get('result', [])
+    ]
+    return {
+        "text": result['text'],
+        "start": words[0]['start'] if words else None,
+        "end": words[-1]['end'] if words else None,
+        "words": words
+    }
+
+def transcribe_pcm(pcm, sample_rate):
+    """Transcribe 16-bit mono PCM, returning its segments with word timings"""
+    recognizer = vosk.KaldiRecognizer(get_stt_model(), sample_rate)
+    recognizer.SetWords(True)
+    
+    results = []
+    step = STT_FEED_FRAMES * 2
+    for start in range(0, len(pcm), step):
+        if recognizer.AcceptWaveform(pcm[start:start + step]):
+            results.append(json.loads(recognizer.Result()))
+    results.append(json.loads(recognizer.FinalResult()))
+    
+    return [segment for segment in map(_result_segment, results) if segment]
+
+def transcribe_audio(data):
+    """Decode, clean up and transcribe an uploaded clip, chunks in parallel
+    
+    Raises SpeechRecognitionError when the pool is busy (or the audio is
+    unusable) and FutureTimeoutError after STT_TIMEOUT seconds.
+    """
+    if vosk is None:
+        raise SpeechRecognitionError("Speech recognition is not installed on the server", 503)
+    
+    samples, sample_rate = decode_audio(data)
+    if not len(samples):
+        raise SpeechRecognitionError("The audio file is empty")
+    
+    chunks, clip_length = preprocess_audio(samples, sample_rate)
+    chunk_segments = [None] * len(chunks)
+    running = {}  # future -> chunk index
+    next_chunk = 0
+    deadline = time.monotonic() + STT_TIMEOUT
+    try:
+        while next_chunk < len(chunks) or running:
+            # Each chunk takes its own slot; when the pool is busy, wait for
+            # one of ours to finish (or give up if none are running)
+            while next_chunk < len(chunks) and len(running) < STT_WORKERS:
+                try:
+                    future = _submit_stt(transcribe_pcm, chunks[next_chunk][0], STT_SAMPLE_RATE)
+                except SpeechRecognitionError:
+                    if not running:
+                        raise
+                    break
+                running[future] = next_chunk
+                next_chunk += 1
+            
+            done, _ = wait(running, timeout=max(deadline - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+            if not done:
+                raise FutureTimeoutError()
+            for future in done:
+                chunk_segments[running.pop(future)] = future.result()
+    except BaseException:
+        # Chunks that already started keep their slot until they finish
+        for future in running:
+            future.cancel()
+        raise
+    
+    # Put the timings back on the clip's timeline, silences included
+    segments = []
+    words = []
+    for (_, spans), found in zip(chunks, chunk_segments):
+        for segment in found:
+            for word in segment['words']:
+                word['start'] = _to_clip_time(word['start'], spans)
+                word['end'] = _to_clip_time(word['end'], spans)
+            words.extend(segment.pop('words'))
+            if segment['start'] is not None:
+                segment['start'] = _to_clip_time(segment['start'], spans)
+                segment['end'] = _to_clip_time(segment['end'], spans)
+            segments.append(segment)
+    
+    return {
+        "text": " ".join(segment['text'] for segment in segments),
+        "duration": round(clip_length / STT_SAMPLE_RATE, 2),
+        "speech_duration": round(sum(end - start for _, spans in chunks for start, end in spans) / STT_SAMPLE_RATE, 2),
+        "segments": segments,
+        "words": words
+    }
+
+def _submit_stt(fn, *args):
+    """Run fn on the transcription pool, or raise if too much work is already waiting"""
+    if vosk is None:
+        raise SpeechRecognitionError("Speech recognition is not installed on the server", 503)
+    
+    if not _stt_slots.acquire(blocking=False):
+        raise SpeechRecognitionError("Speech recognition is busy, please try again shortly", 503)
+    
+    try:
+        future = get_stt_executor().submit(fn, *args)
+    except BaseException:
+        _stt_slots.release()
+        raise
+    future.add_done_callback(lambda _: _stt_slots.release())
+    return future
+
+# Streaming dictation: the recorder opens a stream, then posts small chunks of
+# raw 16-bit mono PCM as they are captured and gets back the partial
+# transcript plus any newly finished segments after each one. Each stream
+# keeps its own recognizer, so nothing is re-decoded and the clip never has
+# to be uploaded as a whole. At most STT_MAX_STREAMS streams are open at
+# once, a stream holds at most STT_STREAM_MAX_BUFFER bytes of audio waiting to
+# be recognized (more is refused with 429 so the client backs off), and
+# streams idle for STT_STREAM_IDLE_TIMEOUT seconds are dropped. Streams live
+# in the process that created them.
+STT_MAX_STREAMS = int(os.environ.get('DIARY_STT_MAX_STREAMS', '8'))
+STT_STREAM_MAX_BUFFER = STT_SAMPLE_RATE * 2 * 5  # 5 seconds of audio
+STT_STREAM_IDLE_TIMEOUT = 60
+_stt_streams = {}  # stream id -> stream
+_stt_streams_lock = threading.Lock()
+
+def _expire_stt_streams():
+    """Drop streams that haven't received audio for STT_STREAM_IDLE_TIMEOUT seconds"""
+    now = time.time()
+    with _stt_streams_lock:
+        expired = [
+            stream_id for stream_id, stream in _stt_streams.items()
+            if now - stream['updated'] > STT_STREAM_IDLE_TIMEOUT
+        ]
+        for stream_id in expired:
+            del _stt_streams[stream_id]
+
+def open_stt_stream(username, sample_rate=STT_SAMPLE_RATE):
+    """Start a transcription stream, or raise if too many are open"""
+    if vosk is None:
+        raise SpeechRecognitionError("Speech recognition is not installed on the server", 503)
+    
+    _expire_stt_streams()
+    stream = {
+        "id": secrets.token_urlsafe(16),
+        "username": username,
+        "sample_rate": sample_rate,
+        "recognizer": None,
+        "lock": threading.Lock(),  # one chunk at a time, in order
+        "buffered": 0,  # bytes received but not yet recognized
+        "samples": 0,
+        "updated": time.time()
+    }
+    
+    # Reserve the slot first, so rejected opens don't pay for loading the
+    # model and building a recognizer
+    with _stt_streams_lock:
+        if len(_stt_streams) >= STT_MAX_STREAMS:
+            raise SpeechRecognitionError("Too many dictations in progress, please try again shortly", 503)
+        _stt_streams[stream['id']] = stream
+    
+    try:
+        recognizer = vosk.KaldiRecognizer(get_stt_model(), sample_rate)
+        recognizer.SetWords(True)
+    except BaseException:
+        close_stt_stream(stream['id'])
+        raise
+    stream['recognizer'] = recognizer
+    return stream
+
+def get_stt_stream(stream_id, username):
+    """Return a user's open stream, or None"""
+    with _stt_streams_lock:
+        stream = _stt_streams.get(stream_id)
+    if stream is None or stream['username'] != username:
+        return None
+    return stream
+
+def close_stt_stream(stream_id):
+    with _stt_streams_lock:
+        _stt_streams.pop(stream_id, None)
+
+def feed_stt_stream(stream, pcm, final=False):
+    """Recognize a chunk of PCM, returning the partial transcript and new final segments"""
+    with stream['lock']:
+        recognizer = stream['recognizer']
+        results = []
+        step = STT_FEED_FRAMES * 2
+        for start in range(0, len(pcm), step):
+            if recognizer.AcceptWaveform(pcm[start:start + step]):
+                results.append(json.loads(recognizer.Result()))
+        if final:
+            results.append(json.loads(recognizer.FinalResult()))
+        
+        segments = [segment for segment in map(_result_segment, results) if segment]
+        stream['samples'] += len(pcm) // 2
+        stream['updated'] = time.time()
+        
+        partial = "" if final else json.loads(recognizer.PartialResult()).get('partial', "")
+        return {
+            "partial": partial,
+            "final": segments,
+            "duration": round(stream['samples'] / stream['sample_rate'], 2)
+        }
+
+def submit_stt_chunk(stream, pcm, final=False):
+    """Queue a chunk for recognition, refusing it if the stream's buffer is full"""
+    with _stt_streams_lock:
+        if stream['buffered'] + len(pcm) > STT_STREAM_MAX_BUFFER:
+            raise SpeechRecognitionError("Too much audio waiting, slow down", 429)
+        stream['buffered'] += len(pcm)
+    
+    def release(_):
+        with _stt_streams_lock:
+            stream['buffered'] -= len(pcm)
+    
+    try:
+        future = _submit_stt(feed_stt_stream, stream, pcm, final)
+    except BaseException:
+        # The chunk was refused (e.g. the pool is busy), so it isn't waiting
+        release(None)
+        raise
+    future.add_done_callback(release)
+    return future
+
 
 # Routes
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    """Record how long the request took (streamed bodies are sent afterwards)"""
+    start = g.pop('request_start', None)
+    if start is not None:
+        elapsed = time.perf_counter() - start
+        # Label by route pattern rather than path so ids don't create new series
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        observe('diary_request_duration_seconds', elapsed,
+                route=route, method=request.method, status=response.status_code)
+        log_event(logging.DEBUG, "request", method=request.method, path=request.path,
+                  status=response.status_code, seconds=f"{elapsed:.4f}")
+    return response
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint"""
+    return render_metrics(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@app.before_request
+def begin_sentiment_backfill():
+    start_sentiment_backfill()
+
 @app.route('/')
 def index():
     if 'username' in session:
@@ -570,20 +2866,15 @@ def login():
         hashed_password = hashlib.sha256(password.encode()).hexdigest()
         
         # Check if user exists
-        users_file = "users.json"
-        if os.path.exists(users_file):
-            with open(users_file, "r") as f:
-                users = json.load(f)
-                
-            if username in users and users[username]["password"] == hashed_password:
-                session['username'] = username
-                session['name'] = users[username]["name"]
-                flash('Login successful!', 'success')
-                return redirect(url_for('dashboard'))
-            else:
-                flash('Invalid username or password', 'error')
+        user = get_user(username)
+        
+        if user and user["password"] == hashed_password:
+            session['username'] = username
+            session['name'] = user["name"]
+            flash('Login successful!', 'success')
+            return redirect(url_for('dashboard'))
         else:
-            flash('No registered users found', 'error')
+            flash('Invalid username or password', 'error')
     
     return render_template('login.html')
 
@@ -607,28 +2898,11 @@ def register():
         # Hash the password for security
         hashed_password = hashlib.sha256(password.encode()).hexdigest()
         
-        # Check if username already exists
-        users_file = "users.json"
-        users = {}
-        
-        if os.path.exists(users_file):
-            with open(users_file, "r") as f:
-                users = json.load(f)
-        
-        if username in users:
+        # Add new user, unless the username already exists
+        if not create_user(username, {"name": fullname, "password": hashed_password}):
             flash('Username already exists', 'error')
             return redirect(url_for('register'))
         
-        # Add new user
-        users[username] = {
-            "name": fullname,
-            "password": hashed_password
-        }
-        
-        # Save to file
-        with open(users_file, "w") as f:
-            json.dump(users, f)
-        
         flash('Registration successful! You can now login.', 'success')
         return redirect(url_for('login'))
     
@@ -647,27 +2921,25 @@ def dashboard():
         flash('Please login first', 'error')
         return redirect(url_for('login'))
     
-    # Load user entries
-    entries = get_user_entries(session['username'])
+    # Load the incrementally maintained stats instead of every entry
+    stats = get_user_stats(session['username'])
     
     # Calculate stats
-    entry_count = len(entries)
-    streak = calculate_streak(entries)
+    entry_count = stats['count']
+    streak = calculate_streak(stats['days'])
     
     # Calculate average word count
     avg_words = 0
-    if entries:
-        avg_words = sum(entry['word_count'] for entry in entries) // len(entries)
-    
-    # Get overall mood
-    overall_mood = calculate_mood(entries)
+    if entry_count:
+        avg_words = stats['total_words'] // entry_count
     
     # Get recent entries (up to 5)
-    recent_entries = sorted(entries, key=lambda x: x['date'], reverse=True)[:5]
+    recent_entries = query_user_entries(session['username'], limit=5)
     
-    # Generate mood chart
-    mood_chart = generate_mood_chart(entries)
+    # Get overall mood from the most recent entries
+    overall_mood = calculate_mood([Entry.from_dict(entry) for entry in recent_entries])
     
+    # The mood chart is loaded separately from /charts/mood.png
     return render_template('dashboard.html', 
                           name=session['name'],
                           entry_count=entry_count,
@@ -675,7 +2947,8 @@ def dashboard():
                           avg_words=avg_words,
                           overall_mood=overall_mood,
                           recent_entries=recent_entries,
-                          mood_chart=mood_chart)
+                          has_mood_chart=entry_count >= 3,
+                          chart_version=get_entries_data_version(session['username'])[0])
 
 @app.route('/diary', methods=['GET', 'POST'])
 def diary():
@@ -699,22 +2972,17 @@ def diary():
             return redirect(url_for('diary'))
         
         # Create entry object
-        entry = {
-            "id": int(datetime.datetime.now().timestamp()),
+        entry = score_entry({
             "date": entry_date,
             "text": text,
-            "word_count": len(text.split()),
-            "mood": analyze_mood(text)
-        }
+            "word_count": len(text.split())
+        })
         
-        # Load existing entries
-        entries = get_user_entries(session['username'])
-        
-        # Add new entry
-        entries.append(entry)
-        
-        # Save entries
-        save_user_entries(session['username'], entries)
+        # Add new entry, picking its id under the write lock so that two
+        # entries saved at the same moment don't get the same id
+        with user_entries_lock(session['username']):
+            entry['id'] = next_entry_id(session['username'])
+            update_user_entries(session['username'], upserts=[entry])
         
         flash('Entry saved successfully!', 'success')
         return redirect(url_for('diary'))
@@ -733,18 +3001,66 @@ def insights():
         flash('Please login first', 'error')
         return redirect(url_for('login'))
     
-    # Load user entries
-    entries = get_user_entries(session['username'])
-    
-    # Generate charts
-    mood_chart = generate_mood_chart(entries)
-    word_chart = generate_word_frequency_chart(entries)
-    patterns_chart = generate_patterns_chart(entries)
+    # Charts are loaded separately from /charts/<kind>.png, so only check
+    # whether there are enough entries for each of them
+    entry_count = count_user_entries(session['username'])
     
     return render_template('insights.html', 
-                          mood_chart=mood_chart,
-                          word_chart=word_chart,
-                          patterns_chart=patterns_chart)
+                          has_mood_chart=entry_count >= 3,
+                          has_word_chart=entry_count >= 3,
+                          has_patterns_chart=entry_count >= 5,
+                          chart_version=get_entries_data_version(session['username'])[0])
+
+# Chart images served by /charts/<kind>.png
+def user_mood_chart_png(username):
+    """Render the mood chart from the user's stats, without loading entries"""
+    stats = get_user_stats(username)
+    if stats['count'] < 3:
+        return None
+    return mood_chart_png_for_days(stats['days'])
+
+def user_word_frequency_chart_png(username):
+    """Render the word frequency chart from the user's word index"""
+    stats = get_user_stats(username)
+    if stats['count'] < 3:
+        return None
+    return word_frequency_chart_png_for_counts(get_user_word_counts(username))
+
+CHART_RENDERERS = {
+    'mood': user_mood_chart_png,
+    'words': user_word_frequency_chart_png,
+    'patterns': lambda username: patterns_chart_png(_load_user_entries(username)[0])
+}
+
+@app.route('/charts/<kind>.png')
+def chart(kind):
+    if 'username' not in session:
+        abort(401)
+    
+    if kind not in CHART_RENDERERS:
+        abort(404)
+    
+    # The ETag only depends on the stored data, so an unchanged diary is
+    # answered with 304 before any entries are loaded or charts rendered
+    data_version, last_modified = get_entries_data_version(session['username'])
+    etag = hashlib.sha256(
+        f"{session['username']}:{kind}:{CHART_STYLE_VERSION}:{data_version}".encode('utf-8')).hexdigest()
+    
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = app.response_class(status=304)
+    else:
+        image_png = CHART_RENDERERS[kind](session['username'])
+        if image_png is None:
+            abort(404)
+        response = app.response_class(image_png, mimetype='image/png')
+    
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    
+    # Let the browser keep the image but check back every time it is used
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
 @app.route('/settings', methods=['GET', 'POST'])
 def settings():
@@ -763,14 +3079,9 @@ def settings():
                 return redirect(url_for('settings'))
             
             # Update user profile
-            users_file = "users.json"
-            with open(users_file, "r") as f:
-                users = json.load(f)
-            
-            users[session['username']]['name'] = fullname
-            
-            with open(users_file, "w") as f:
-                json.dump(users, f)
+            user = get_user(session['username'])
+            user['name'] = fullname
+            save_user(session['username'], user)
             
             # Update session
             session['name'] = fullname
@@ -795,59 +3106,264 @@ def settings():
             hashed_new = hashlib.sha256(new_password.encode()).hexdigest()
             
             # Check current password
-            users_file = "users.json"
-            with open(users_file, "r") as f:
-                users = json.load(f)
+            user = get_user(session['username'])
             
-            if users[session['username']]['password'] != hashed_current:
+            if user['password'] != hashed_current:
                 flash('Current password is incorrect', 'error')
                 return redirect(url_for('settings'))
             
             # Update password
-            users[session['username']]['password'] = hashed_new
-            
-            with open(users_file, "w") as f:
-                json.dump(users, f)
+            user['password'] = hashed_new
+            save_user(session['username'], user)
             
             flash('Password changed successfully!', 'success')
-            
-        elif action == 'export_data':
-            # Load user entries
-            entries = get_user_entries(session['username'])
-            
-            if not entries:
-                flash('No entries to export', 'error')
-                return redirect(url_for('settings'))
-            
-            # Create export data
-            export_data = {
-                "user": session['name'],
-                "exported_on": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "entries": entries
-            }
-            
-            # Save to file
-            export_file = f"export_{session['username']}_{datetime.datetime.now().strftime('%Y%m%d')}.json"
-            
-            with open(export_file, "w") as f:
-                json.dump(export_data, f, indent=2)
-            
-            flash(f'Data exported successfully to {export_file}', 'success')
     
     # Get user data
-    users_file = "users.json"
-    with open(users_file, "r") as f:
-        users = json.load(f)
-    
-    fullname = users[session['username']]['name']
+    fullname = get_user(session['username'])['name']
     
     return render_template('settings.html', fullname=fullname, username=session['username'])
 
+# Exports are streamed: entries are read one at a time (a database cursor
+# or the cached entry list), serialised and sent in EXPORT_CHUNK_BYTES
+# pieces, optionally gzipped as they go, so memory use doesn't grow with the
+# diary and nothing is written to the server's disk.
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'json': 'application/json'}
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+def export_chunks(username, name, format='ndjson', date_from=None, date_to=None):
+    """Yield an export of the user's entries as strings"""
+    entries = iter_user_entries(username, date_from, date_to)
+    
+    if format == 'ndjson':
+        for entry in entries:
+            yield json.dumps(entry, ensure_ascii=False) + "\n"
+        return
+    
+    # Same layout as a single JSON document: {"user", "exported_on", "entries": [...]}
+    exported_on = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    yield f'{{"user": {json.dumps(name)}, "exported_on": "{exported_on}", "entries": ['
+    separator = ""
+    for entry in entries:
+        yield separator + json.dumps(entry, ensure_ascii=False)
+        separator = ", "
+    yield "]}\n"
+
+def buffer_chunks(pieces, size=EXPORT_CHUNK_BYTES):
+    """Join small strings into UTF-8 chunks of about size bytes"""
+    buffer = []
+    buffered = 0
+    for piece in pieces:
+        data = piece.encode('utf-8')
+        buffer.append(data)
+        buffered += len(data)
+        if buffered >= size:
+            yield b"".join(buffer)
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield b"".join(buffer)
+
+def gzip_chunks(chunks):
+    """Gzip a stream of byte chunks on the fly"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # 16+: gzip header
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+@app.route('/export')
+def export_entries():
+    """Download entries as NDJSON or JSON, optionally gzipped and limited to a date range"""
+    if 'username' not in session:
+        flash('Please login first', 'error')
+        return redirect(url_for('login'))
+    
+    format = request.args.get('format', 'ndjson')
+    if format not in EXPORT_FORMATS:
+        abort(400)
+    compress = request.args.get('gzip') == '1'
+    date_from = parse_date_arg(request.args.get('from'))
+    date_to = parse_date_arg(request.args.get('to'))
+    
+    filename = f"diary_{session['username']}_{datetime.datetime.now().strftime('%Y%m%d')}.{format}"
+    chunks = buffer_chunks(export_chunks(session['username'], session['name'], format, date_from, date_to))
+    if compress:
+        chunks = gzip_chunks(chunks)
+        filename += ".gz"
+    
+    response = app.response_class(stream_with_context(chunks),
+                                  mimetype='application/gzip' if compress else EXPORT_FORMATS[format])
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
 @app.route('/api/speech-to-text', methods=['POST'])
 def speech_to_text():
-    # This would normally use a speech recognition API
-    # For now, we'll just return a placeholder response
-    return jsonify({"text": "This is a placeholder for speech recognition."})
+    if 'username' not in session:
+        abort(401)
+    
+    if request.content_length and request.content_length > STT_MAX_UPLOAD_BYTES:
+        return jsonify({"error": "Audio file is too large"}), 413
+    
+    # Accept either a multipart upload (field "audio") or the raw audio as the body
+    upload = request.files.get('audio')
+    data = upload.read() if upload else request.get_data()
+    if not data:
+        return jsonify({"error": "No audio received"}), 400
+    
+    try:
+        result = transcribe_audio(data)
+    except SpeechRecognitionError as e:
+        return stt_error_response(e)
+    except FutureTimeoutError:
+        return jsonify({"error": "Transcription timed out"}), 504
+    
+    return jsonify(result)
+
+def stt_error_response(error):
+    """JSON response for a SpeechRecognitionError"""
+    response = jsonify({"error": str(error)})
+    if error.status in (429, 503):
+        response.headers['Retry-After'] = '1' if error.status == 429 else '5'
+    return response, error.status
+
+@app.route('/api/speech-to-text/streams', methods=['POST'])
+def open_speech_stream():
+    if 'username' not in session:
+        abort(401)
+    
+    sample_rate = request.args.get('rate', STT_SAMPLE_RATE, type=int)
+    if not 8000 <= sample_rate <= 48000:
+        return jsonify({"error": "Unsupported sample rate"}), 400
+    
+    try:
+        stream = open_stt_stream(session['username'], sample_rate)
+    except SpeechRecognitionError as e:
+        return stt_error_response(e)
+    
+    return jsonify({
+        "stream_id": stream['id'],
+        "sample_rate": sample_rate,
+        "max_buffer": STT_STREAM_MAX_BUFFER,
+        "chunk_url": url_for('speech_stream_chunk', stream_id=stream['id'])
+    }), 201
+
+@app.route('/api/speech-to-text/streams/<stream_id>', methods=['POST', 'DELETE'])
+def speech_stream_chunk(stream_id):
+    """Feed a chunk of raw 16-bit mono PCM; ?final=1 ends the stream"""
+    if 'username' not in session:
+        abort(401)
+    
+    stream = get_stt_stream(stream_id, session['username'])
+    if stream is None:
+        return jsonify({"error": "Stream not found"}), 404
+    
+    if request.method == 'DELETE':
+        close_stt_stream(stream_id)
+        return '', 204
+    
+    if request.content_length and request.content_length > STT_STREAM_MAX_BUFFER:
+        return jsonify({"error": "Chunk is too large"}), 413
+    pcm = request.get_data()
+    if len(pcm) % 2:
+        return jsonify({"error": "Chunks must contain whole 16-bit samples"}), 400
+    
+    final = request.args.get('final') == '1'
+    try:
+        result = submit_stt_chunk(stream, pcm, final).result(timeout=STT_TIMEOUT)
+    except SpeechRecognitionError as e:
+        return stt_error_response(e)
+    except FutureTimeoutError:
+        return jsonify({"error": "Transcription timed out"}), 504
+    
+    if final:
+        close_stt_stream(stream_id)
+    return jsonify(result)
+
+@app.route('/api/entries/import', methods=['POST'])
+def import_entries():
+    """Import entries from an NDJSON or CSV upload (field "file") or request body"""
+    if 'username' not in session:
+        abort(401)
+    
+    if request.content_length and request.content_length > IMPORT_MAX_BYTES:
+        return jsonify({"error": "Import file is too large"}), 413
+    
+    upload = request.files.get('file')
+    if upload:
+        data = upload.read()
+        format = request.args.get('format') or detect_import_format(upload.filename, upload.content_type)
+    else:
+        data = request.get_data()
+        format = request.args.get('format') or detect_import_format(content_type=request.content_type)
+    
+    if not data:
+        return jsonify({"error": "No entries received"}), 400
+    if format not in IMPORT_FORMATS:
+        return jsonify({"error": "Format must be ndjson or csv"}), 400
+    try:
+        text = data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        return jsonify({"error": "Import files must be UTF-8"}), 400
+    
+    try:
+        summary = import_user_entries(session['username'], text, format)
+    except EntryImportError as e:
+        return jsonify({"error": str(e), "line": e.line}), 400
+    
+    return jsonify(summary), 201
+
+@app.route('/api/entries/dates')
+def entry_dates():
+    if 'username' not in session:
+        abort(401)
+    
+    month = request.args.get('month')
+    bounds = parse_month_arg(month)
+    if not bounds:
+        return jsonify({"error": "Month must be YYYY-MM"}), 400
+    
+    return jsonify({"month": month, "dates": get_entry_dates(session['username'], *bounds)})
+
+@app.route('/api/search')
+def search():
+    if 'username' not in session:
+        abort(401)
+    
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"error": "Missing search query"}), 400
+    
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', ENTRIES_PER_PAGE, type=int), 1), MAX_ENTRIES_PER_PAGE)
+    
+    total, matches = search_user_entries(session['username'], query, limit=per_page,
+                                         offset=(page - 1) * per_page)
+    
+    entries = get_user_entries_by_id(session['username'], [entry_id for entry_id, _, _ in matches])
+    
+    results = []
+    for entry_id, score, positions in matches:
+        entry = entries.get(entry_id)
+        if entry is None:
+            continue
+        results.append({
+            "id": entry['id'],
+            "date": entry['date'],
+            "mood": entry['mood'],
+            "score": round(score, 4),
+            "snippet": str(search_snippet(entry['text'], positions)),
+            "url": url_for('view_entry', entry_id=entry['id'])
+        })
+    
+    return jsonify({
+        "query": query,
+        "total": total,
+        "page": page,
+        "per_page": per_page,
+        "has_next": page * per_page < total,
+        "results": results
+    })
 
 @app.route('/entries')
 def entries():
@@ -855,13 +3371,77 @@ def entries():
         flash('Please login first', 'error')
         return redirect(url_for('login'))
     
-    # Load user entries
-    entries = get_user_entries(session['username'])
-    
-    # Sort entries by date (newest first)
-    entries = sorted(entries, key=lambda x: x['date'], reverse=True)
-    
-    return render_template('entries.html', entries=entries)
+    # Read filters from the query string
+    mood = request.args.get('mood', 'all').lower()
+    if mood not in ('positive', 'neutral', 'negative'):
+        mood = 'all'
+    date_from = parse_date_arg(request.args.get('from'))
+    date_to = parse_date_arg(request.args.get('to'))
+    sort = 'oldest' if request.args.get('sort') == 'oldest' else 'newest'
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', ENTRIES_PER_PAGE, type=int), 1), MAX_ENTRIES_PER_PAGE)
+    after = parse_entry_cursor(request.args.get('after'))
+    before = parse_entry_cursor(request.args.get('before'))
+    
+    filters = {
+        "date_from": date_from,
+        "date_to": date_to,
+        "mood": mood.capitalize() if mood != 'all' else None
+    }
+    newest_first = sort == 'newest'
+    
+    # Fetch one extra entry to find out whether there is another page. Cursors
+    # are used when following next/previous links; page alone falls back to an
+    # offset so that pages can still be linked directly.
+    if before:
+        page_entries = query_user_entries(session['username'], newest_first=not newest_first,
+                                          limit=per_page + 1, after=before, **filters)
+        has_prev = len(page_entries) > per_page
+        page_entries = page_entries[:per_page][::-1]
+        has_next = True
+    else:
+        offset = 0 if after else (page - 1) * per_page
+        page_entries = query_user_entries(session['username'], newest_first=newest_first,
+                                          limit=per_page + 1, offset=offset, after=after, **filters)
+        has_next = len(page_entries) > per_page
+        page_entries = page_entries[:per_page]
+        has_prev = page > 1
+    
+    # Links keep the current filters
+    args = {"mood": mood, "sort": sort, "per_page": per_page}
+    if date_from:
+        args["from"] = date_from
+    if date_to:
+        args["to"] = date_to
+    
+    next_url = prev_url = None
+    if has_next and page_entries:
+        last = page_entries[-1]
+        next_url = url_for('entries', page=page + 1, after=f"{last['date']}:{last['id']}", **args)
+    if has_prev and page_entries:
+        first = page_entries[0]
+        if page - 1 <= 1:
+            prev_url = url_for('entries', **args)
+        else:
+            prev_url = url_for('entries', page=page - 1, before=f"{first['date']}:{first['id']}", **args)
+    
+    # The calendar opens on the selected day's month (or this month); other
+    # months' dates are fetched from /api/entries/dates when it changes month
+    calendar_month = (date_from if date_from and date_from == date_to else datetime.date.today().isoformat())[:7]
+    
+    return render_template('entries.html',
+                          entries=page_entries,
+                          total=count_user_entries(session['username'], **filters),
+                          calendar_month=calendar_month,
+                          entry_dates=get_entry_dates(session['username'], *parse_month_arg(calendar_month)),
+                          mood=mood,
+                          sort=sort,
+                          date_from=date_from,
+                          date_to=date_to,
+                          page=page,
+                          per_page=per_page,
+                          next_url=next_url,
+                          prev_url=prev_url)
 
 @app.route('/entry/<int:entry_id>')
 def view_entry(entry_id):
@@ -869,15 +3449,12 @@ def view_entry(entry_id):
         flash('Please login first', 'error')
         return redirect(url_for('login'))
     
-    # Load user entries
-    entries = get_user_entries(session['username'])
-    
     # Find the specific entry
-    entry = next((e for e in entries if e['id'] == entry_id), None)
+    entry = get_user_entry(session['username'], entry_id)
     
     if not entry:
         flash('Entry not found', 'error')
-        return redirect(url_for('view_entries'))
+        return redirect(url_for('entries'))
     
     return render_template('view_entry.html', entry=entry)
 
@@ -887,24 +3464,17 @@ def edit_entry(entry_id):
         flash('Please login first', 'error')
         return redirect(url_for('login'))
     
-    # Load user entries
-    entries = get_user_entries(session['username'])
-    
     # Find the specific entry
-    entry_index = next((i for i, e in enumerate(entries) if e['id'] == entry_id), None)
+    entry = get_user_entry(session['username'], entry_id)
     
-    if entry_index is None:
+    if entry is None:
         flash('Entry not found', 'error')
-        return redirect(url_for('view_entries'))
+        return redirect(url_for('entries'))
     
     if request.method == 'POST':
         text = request.form['diary_text'].strip()
         new_date = request.form['entry_date']
         
-        # Debug information
-        print(f"Form data - Text: {text}, Date: {new_date}")
-        print(f"Original entry date: {entries[entry_index]['date']}")
-        
         if not text:
             flash('Please enter some text before saving', 'error')
             return redirect(url_for('edit_entry', entry_id=entry_id))
@@ -916,22 +3486,22 @@ def edit_entry(entry_id):
             flash('Invalid date format. Please use YYYY-MM-DD format.', 'error')
             return redirect(url_for('edit_entry', entry_id=entry_id))
         
-        # Update entry
-        entries[entry_index]['text'] = text
-        entries[entry_index]['date'] = new_date
-        entries[entry_index]['word_count'] = len(text.split())
-        entries[entry_index]['mood'] = analyze_mood(text)
-        
-        # Debug information after update
-        print(f"Updated entry date: {entries[entry_index]['date']}")
+        # Update entry, only rescoring the sentences that changed
+        previous = dict(entry)
+        entry['text'] = text
+        entry['date'] = new_date
+        entry['word_count'] = len(text.split())
+        score_entry(entry, previous)
+        log_event(logging.DEBUG, "entry.edit", user=session['username'], id=entry_id,
+                  old_date=previous['date'], new_date=new_date, word_count=entry['word_count'])
         
-        # Save entries
-        save_user_entries(session['username'], entries)
+        # Save entry
+        update_user_entries(session['username'], upserts=[entry])
         
         flash('Entry updated successfully!', 'success')
         return redirect(url_for('view_entry', entry_id=entry_id))
     
-    return render_template('edit_entry.html', entry=entries[entry_index])
+    return render_template('edit_entry.html', entry=entry)
 
 @app.route('/entry/delete/<int:entry_id>', methods=['POST'])
 def delete_entry(entry_id):
@@ -939,14 +3509,8 @@ def delete_entry(entry_id):
         flash('Please login first', 'error')
         return redirect(url_for('login'))
     
-    # Load user entries
-    entries = get_user_entries(session['username'])
-    
-    # Find and remove the specific entry
-    entries = [e for e in entries if e['id'] != entry_id]
-    
-    # Save entries
-    save_user_entries(session['username'], entries)
+    # Remove the specific entry
+    update_user_entries(session['username'], deletes=[entry_id])
     
     flash('Entry deleted successfully!', 'success')
     return redirect(url_for('entries'))
@@ -967,24 +3531,173 @@ def delete_multiple_entries():
     # Convert IDs to integers
     entry_ids = [int(id) for id in entry_ids]
     
-    # Load user entries
-    entries = get_user_entries(session['username'])
-    
-    # Count entries before deletion
-    entries_count_before = len(entries)
-    
     # Remove selected entries
-    entries = [e for e in entries if e['id'] not in entry_ids]
-    
-    # Count deleted entries
-    deleted_count = entries_count_before - len(entries)
-    
-    # Save updated entries
-    save_user_entries(session['username'], entries)
+    deleted_count = update_user_entries(session['username'], deletes=entry_ids)
     
     flash(f'{deleted_count} entries deleted successfully!', 'success')
     return redirect(url_for('entries'))
 
+# PDF reports are built in a pool of worker processes so that large reports
+# don't tie up a request thread. Each job is identified by a hash of the user,
+# report type and entry data version, so asking for the same report twice
+# reuses the running (or finished) job. The finished PDF is kept in memory
+# (never on disk) until the job expires after REPORT_JOB_TTL seconds, or
+# earlier when finished PDFs take more than REPORT_CACHE_MAX_BYTES, in which
+# case the least recently used jobs are dropped first.
+REPORT_WORKERS = int(os.environ.get('DIARY_REPORT_WORKERS', 2))
+REPORT_JOB_TTL = 60 * 60
+REPORT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+REPORT_WAIT_TIMEOUT = 120
+_report_executor = None
+_report_jobs = OrderedDict()  # job id -> job dict, least recently used first
+_report_jobs_lock = threading.Lock()
+
+def get_report_executor():
+    """Return the shared report worker pool, starting it on first use"""
+    global _report_executor
+    
+    with _report_jobs_lock:
+        if _report_executor is None:
+            # Spawn fresh workers rather than forking a process full of threads
+            # that may be holding locks
+            _report_executor = ProcessPoolExecutor(
+                max_workers=REPORT_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _report_executor
+
+def submit_report_build(*args):
+    """Submit a report build, replacing the pool once if a dead worker broke it
+    
+    A worker that dies (e.g. killed for running out of memory) leaves the
+    pool unusable, so it is dropped and a fresh one started. If that fails
+    too, the returned future holds the error and the job shows as failed.
+    """
+    global _report_executor
+    
+    for attempt in range(2):
+        executor = get_report_executor()
+        try:
+            return executor.submit(timed_pdf_report, *args)
+        except BrokenProcessPool as e:
+            log_event(logging.WARNING, "report.pool_broken", attempt=attempt + 1)
+            with _report_jobs_lock:
+                if _report_executor is executor:
+                    _report_executor = None
+            executor.shutdown(wait=False)
+            error = e
+    
+    future = Future()
+    future.set_exception(error)
+    return future
+
+def report_filename(report_type):
+    """Return the download filename for a report type"""
+    if report_type == "monthly":
+        return f"monthly_diary_report_{datetime.datetime.now().strftime('%Y_%m')}.pdf"
+    elif report_type == "mood":
+        return f"mood_analysis_report_{datetime.datetime.now().strftime('%Y_%m_%d')}.pdf"
+    else:
+        return f"diary_report_{datetime.datetime.now().strftime('%Y_%m_%d')}.pdf"
+
+def _report_job_size(job):
+    """Bytes held by a finished job's PDF (0 while it is still running)"""
+    future = job['future']
+    if not future.done() or future.cancelled() or future.exception():
+        return 0
+    pdf_data, _ = future.result()
+    return len(pdf_data) if pdf_data else 0
+
+def _expire_report_jobs():
+    """Forget finished jobs older than REPORT_JOB_TTL, then the least recently used over the byte cap"""
+    now = time.time()
+    with _report_jobs_lock:
+        expired = [
+            job_id for job_id, job in _report_jobs.items()
+            if job['future'].done() and now - job['created'] > REPORT_JOB_TTL
+        ]
+        for job_id in expired:
+            del _report_jobs[job_id]
+        
+        sizes = {job_id: _report_job_size(job) for job_id, job in _report_jobs.items()}
+        total = sum(sizes.values())
+        for job_id, size in sizes.items():
+            if total <= REPORT_CACHE_MAX_BYTES:
+                break
+            if size:
+                del _report_jobs[job_id]
+                total -= size
+
+def submit_report_job(username, name, report_type):
+    """Queue a report and return its job, reusing an identical job if there is one"""
+    _expire_report_jobs()
+    
+    data_version, _ = get_entries_data_version(username)
+    today = datetime.datetime.now().strftime('%Y-%m-%d')
+    job_id = hashlib.sha256(
+        f"{username}:{name}:{report_type}:{data_version}:{today}".encode('utf-8')).hexdigest()[:32]
+    
+    with _report_jobs_lock:
+        job = _report_jobs.get(job_id)
+        if job and report_job_status(job) != "failed":
+            _report_jobs.move_to_end(job_id)
+            return job
+    
+    entries, _ = _load_user_entries(username)
+    future = submit_report_build(name, entries, report_type)
+    future.add_done_callback(_record_report_time)
+    job = {
+        "id": job_id,
+        "username": username,
+        "report_type": report_type,
+        "filename": report_filename(report_type),
+        "created": time.time(),
+        "future": future
+    }
+    
+    with _report_jobs_lock:
+        # Another request may have queued the same report meanwhile; keep the first
+        existing = _report_jobs.get(job_id)
+        if existing and not existing['future'].done():
+            future.cancel()
+            return existing
+        _report_jobs[job_id] = job
+        _report_jobs.move_to_end(job_id)
+    
+    return job
+
+def timed_pdf_report(username, entries, report_type):
+    """Worker process body: build a report and return (pdf bytes, seconds taken)"""
+    start = time.perf_counter()
+    pdf_data = generate_pdf_report(username, entries, report_type)
+    return pdf_data, time.perf_counter() - start
+
+def _record_report_time(future):
+    """Record a finished report's build time, which was measured in the worker"""
+    if not future.cancelled() and future.exception() is None:
+        observe('diary_span_duration_seconds', future.result()[1], span='report.pdf')
+
+def get_report_job(job_id, username):
+    """Return a user's report job, or None"""
+    _expire_report_jobs()
+    with _report_jobs_lock:
+        job = _report_jobs.get(job_id)
+        if job is None or job['username'] != username:
+            return None
+        _report_jobs.move_to_end(job_id)
+    return job
+
+def report_job_status(job):
+    """Describe a report job as a status string"""
+    future = job['future']
+    if not future.done():
+        return "running" if future.running() else "pending"
+    if future.cancelled() or future.exception() or not future.result()[0]:
+        return "failed"
+    return "done"
+
+def wants_json():
+    """Whether the client asked for a JSON response rather than a page"""
+    return request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json'
+
 @app.route('/generate_report', methods=['POST'])
 def generate_report():
     if 'username' not in session:
@@ -993,40 +3706,254 @@ def generate_report():
     
     report_type = request.form.get('report_type', 'all')
     
-    # Load user entries
-    entries = get_user_entries(session['username'])
-    
-    if not entries:
+    if not count_user_entries(session['username']):
+        if wants_json():
+            return jsonify({"error": "No entries to generate report"}), 400
         flash('No entries to generate report', 'error')
         return redirect(url_for('settings'))
     
+    job = submit_report_job(session['username'], session['name'], report_type)
+    
+    if wants_json():
+        return jsonify({
+            "job_id": job['id'],
+            "status": report_job_status(job),
+            "status_url": url_for('report_status', job_id=job['id']),
+            "download_url": url_for('download_report', job_id=job['id'])
+        }), 202
+    
+    # Without JavaScript, go straight to the download, which waits for the job
+    return redirect(url_for('download_report', job_id=job['id']))
+
+@app.route('/reports/<job_id>')
+def report_status(job_id):
+    if 'username' not in session:
+        abort(401)
+    
+    job = get_report_job(job_id, session['username'])
+    if job is None:
+        return jsonify({"error": "Report not found"}), 404
+    
+    status = report_job_status(job)
+    response = {"job_id": job['id'], "status": status}
+    if status == "done":
+        response["download_url"] = url_for('download_report', job_id=job['id'])
+    return jsonify(response)
+
+@app.route('/reports/<job_id>/download')
+def download_report(job_id):
+    if 'username' not in session:
+        flash('Please login first', 'error')
+        return redirect(url_for('login'))
+    
+    job = get_report_job(job_id, session['username'])
+    if job is None:
+        flash('Report not found, please generate it again', 'error')
+        return redirect(url_for('settings'))
+    
     try:
-        # Generate PDF report
-        pdf_path = generate_pdf_report(session['name'], entries, report_type)
-        
-        if not pdf_path:
-            flash('Failed to generate report', 'error')
-            return redirect(url_for('settings'))
-        
-        # Generate a filename for the download
-        if report_type == "monthly":
-            filename = f"monthly_diary_report_{datetime.datetime.now().strftime('%Y_%m')}.pdf"
-        elif report_type == "mood":
-            filename = f"mood_analysis_report_{datetime.datetime.now().strftime('%Y_%m_%d')}.pdf"
-        else:
-            filename = f"diary_report_{datetime.datetime.now().strftime('%Y_%m_%d')}.pdf"
-        
-        # Send the file
-        return send_file(
-            pdf_path,
-            as_attachment=True,
-            download_name=filename,
-            mimetype='application/pdf'
-        )
+        pdf_data, _ = job['future'].result(timeout=REPORT_WAIT_TIMEOUT)
+    except FutureTimeoutError:
+        flash('The report is still being generated, please try again shortly', 'error')
+        return redirect(url_for('settings'))
     except Exception as e:
-        print(f"Error in generate_report: {e}")
+        log_event(logging.ERROR, "report.failed", job=job_id, error=e)
         flash('An error occurred while generating the report', 'error')
         return redirect(url_for('settings'))
+    
+    if not pdf_data:
+        flash('Failed to generate report', 'error')
+        return redirect(url_for('settings'))
+    
+    # Stream the PDF from memory
+    return send_file(
+        BytesIO(pdf_data),
+        as_attachment=True,
+        download_name=job['filename'],
+        mimetype='application/pdf'
+    )
+
+# CLI commands
+BENCHMARK_TEXTS = [
+    "Today was a great day, I went for a walk and felt really happy.",
+    "I am having a terrible day, nothing went right at work.",
+    "Had lunch, answered some emails and went to bed early.",
+    "I love spending time with my family on the weekend!",
+    "Feeling sad and tired, I hope tomorrow is better.",
+]
+
+@app.cli.command('bench-sentiment')
+@click.option('--runs', default=20, show_default=True, help='Number of entries to score per variant.')
+def bench_sentiment(runs):
+    """Compare per-entry mood analysis latency before and after sharing the analyzer"""
+    # Number every text so each one is a new sentence; repeats would only
+    # measure the sentence score cache
+    texts = [f"Entry {i}: {BENCHMARK_TEXTS[i % len(BENCHMARK_TEXTS)]}" for i in range(runs)]
+    
+    # Old behaviour: build a new analyzer for every entry
+    start = time.perf_counter()
+    for text in texts:
+        mood_from_compound(SentimentIntensityAnalyzer().polarity_scores(text)['compound'])
+    per_call = (time.perf_counter() - start) / runs
+    
+    # Shared analyzer (the first call pays for loading the lexicon)
+    start = time.perf_counter()
+    get_sentiment_analyzer()
+    warmup = time.perf_counter() - start
+    
+    with _sentence_scores_lock:
+        _sentence_scores.clear()
+    start = time.perf_counter()
+    for text in texts:
+        analyze_mood(text)
+    shared = (time.perf_counter() - start) / runs
+    
+    # Scoring the same texts again, as when an entry is re-saved unchanged,
+    # is answered from the sentence cache
+    start = time.perf_counter()
+    for text in texts:
+        analyze_mood(text)
+    cached = (time.perf_counter() - start) / runs
+    
+    # Batch scoring, starting from an empty sentence cache again
+    with _sentence_scores_lock:
+        _sentence_scores.clear()
+    start = time.perf_counter()
+    analyze_moods(texts)
+    batched = (time.perf_counter() - start) / runs
+    
+    click.echo(f"Entries scored per variant: {runs}")
+    click.echo(f"New analyzer per entry: {per_call * 1000:.3f} ms/entry")
+    click.echo(f"Shared analyzer:        {shared * 1000:.3f} ms/entry (one-off load {warmup * 1000:.1f} ms)")
+    click.echo(f"Unchanged text again:   {cached * 1000:.3f} ms/entry (sentence cache)")
+    click.echo(f"analyze_moods batch:    {batched * 1000:.3f} ms/entry")
+    click.echo(f"Speed-up from sharing the analyzer: {per_call / max(shared, 1e-9):.0f}x")
+
+@app.cli.command('compact-entries')
+@click.argument('usernames', nargs=-1)
+def compact_entries_command(usernames):
+    """Fold entry journals into their snapshots (all users by default)"""
+    if not usernames:
+        files = glob.glob("entries_*.json") + glob.glob("entries_*.log")
+        usernames = sorted({os.path.splitext(f)[0][len("entries_"):] for f in files})
+    
+    for username in usernames:
+        with user_entries_lock(username):
+            entries = _read_journal(username)
+            compact_user_entries(username, entries)
+            invalidate_user_entries(username)
+        click.echo(f"{username}: {len(entries)} entries")
+
+@app.cli.command('backfill-sentiment')
+@click.argument('usernames', nargs=-1)
+@click.option('--batch-size', default=SENTIMENT_BACKFILL_BATCH, show_default=True, help='Entries scored per write.')
+def backfill_sentiment_command(usernames, batch_size):
+    """Store sentiment scores on entries that don't have them yet (all users by default)"""
+    for username in usernames or entry_usernames():
+        start = time.perf_counter()
+        scored = backfill_user_sentiment(username, batch_size)
+        click.echo(f"{username}: scored {scored} entries in {time.perf_counter() - start:.2f}s")
+
+@app.cli.command('import-entries')
+@click.argument('username')
+@click.argument('file', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--format', 'format', type=click.Choice(IMPORT_FORMATS), default=None,
+              help='File format (defaults to csv for .csv files, otherwise ndjson).')
+def import_entries_command(username, file, format):
+    """Import a user's entries from an NDJSON or CSV file"""
+    if get_user(username) is None:
+        raise click.ClickException(f"No such user: {username}")
+    
+    try:
+        summary = import_user_entries(username, file.read(), format or detect_import_format(file.name))
+    except EntryImportError as e:
+        raise click.ClickException(str(e))
+    
+    click.echo(f"{username}: imported {summary['imported']} entries in {summary['seconds']:.2f}s "
+               f"({summary['entries_per_second']} entries/sec)")
+
+@app.cli.command('import-sqlite')
+@click.option('--database', default=None, help='SQLite file to import into (defaults to DIARY_DATABASE).')
+def import_sqlite_command(database):
+    """Copy users.json and every entries_*.json into the SQLite database"""
+    db = get_db(database)
+    
+    users = {}
+    if os.path.exists(USERS_FILE):
+        with open(USERS_FILE, "r") as f:
+            users = json.load(f)
+    
+    with db:
+        db.executemany(
+            "INSERT INTO users (username, name, password) VALUES (?, ?, ?) "
+            "ON CONFLICT (username) DO UPDATE SET name = excluded.name, password = excluded.password",
+            [(username, user['name'], user['password']) for username, user in users.items()])
+    click.echo(f"Imported {len(users)} users")
+    
+    files = glob.glob("entries_*.json") + glob.glob("entries_*.log")
+    for username in sorted({os.path.splitext(f)[0][len("entries_"):] for f in files}):
+        entries = _read_journal(username)
+        _sqlite_replace_entries(db, username, entries)
+        click.echo(f"{username}: {len(entries)} entries")
+
+def _stress_writer(directory, writer, threads, entries_per_thread):
+    """Process body for stress-entries: add entries from several threads"""
+    os.chdir(directory)
+    
+    def write(thread):
+        for i in range(entries_per_thread):
+            entry_id = (writer * threads + thread) * entries_per_thread + i + 1
+            entry = {"id": entry_id, "date": "2024-01-01", "text": f"entry {entry_id}",
+                     "word_count": 2, "mood": "Neutral"}
+            if i % 2:
+                update_user_entries("stress", upserts=[entry])
+            else:
+                # Exercise the full-list save path too
+                with user_entries_lock("stress"):
+                    save_user_entries("stress", get_user_entries("stress") + [entry])
+    
+    workers = [threading.Thread(target=write, args=(thread,)) for thread in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+@app.cli.command('stress-entries')
+@click.option('--processes', default=4, help='Number of writer processes.')
+@click.option('--threads', default=4, help='Writer threads per process.')
+@click.option('--entries', 'entries_per_thread', default=25, help='Entries each thread adds.')
+def stress_entries_command(processes, threads, entries_per_thread):
+    """Add entries from concurrent writers in a scratch directory and check none are lost"""
+    directory = tempfile.mkdtemp(prefix="diary-stress-")
+    # Keep an absolute DIARY_DATABASE from pointing the writers at real data
+    os.environ['DIARY_DATABASE'] = os.path.join(directory, "diary.db")
+    click.echo(f"Writing to {directory} with the {STORAGE_BACKEND} backend")
+    
+    start = time.perf_counter()
+    context = multiprocessing.get_context("spawn")
+    writers = [
+        context.Process(target=_stress_writer, args=(directory, writer, threads, entries_per_thread))
+        for writer in range(processes)
+    ]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+    elapsed = time.perf_counter() - start
+    
+    # Read back from disk in a fresh process so no cache can hide a lost write
+    with context.Pool(1) as pool:
+        stored_ids = pool.apply(_stress_stored_ids, (directory,))
+    
+    expected = processes * threads * entries_per_thread
+    lost = set(range(1, expected + 1)) - stored_ids
+    click.echo(f"{expected} entries written in {elapsed:.2f}s, {len(stored_ids)} stored, {len(lost)} lost")
+    if lost or any(writer.exitcode for writer in writers):
+        raise click.ClickException("Concurrent writes lost entries or a writer failed")
+
+def _stress_stored_ids(directory):
+    os.chdir(directory)
+    return {entry.id for entry in _read_entries("stress")}
 
 # Run the app
 if __name__ == '__main__':